@@ -0,0 +1,106 @@
+"""Process-wide admission control for conversions.
+
+All sessions queue their files here in arrival order. A file is admitted when
+fewer than the maximum number of conversions are running and its size fits in
+the in-flight byte budget, so CPU and memory stay bounded however many users
+start a batch at once.
+
+Limits are configured through environment variables:
+    ASYCUDA_MAX_CONCURRENT_CONVERSIONS  conversions running at once (default: CPU count)
+    ASYCUDA_MAX_INFLIGHT_MB             input bytes being converted at once (default 256)
+"""
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+MB = 1024 * 1024
+MAX_CONCURRENT_CONVERSIONS = int(os.environ.get('ASYCUDA_MAX_CONCURRENT_CONVERSIONS', str(os.cpu_count() or 1)))
+MAX_INFLIGHT_BYTES = int(os.environ.get('ASYCUDA_MAX_INFLIGHT_MB', '256')) * MB
+
+class AdmissionController:
+    """FIFO work queue with limits on concurrent conversions and in-flight bytes"""
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_CONVERSIONS, max_inflight_bytes=MAX_INFLIGHT_BYTES):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_inflight_bytes = max_inflight_bytes
+        self.condition = threading.Condition()
+        self.waiting = deque()  # (ticket, nbytes) in arrival order
+        self.tickets = itertools.count()
+        self.active = 0
+        self.inflight_bytes = 0
+        self.avg_seconds = 1.0  # running estimate of one conversion's duration
+        self.completed = 0
+
+    def _can_admit(self, nbytes):
+        if self.active >= self.max_concurrent:
+            return False
+        # A file larger than the whole budget still runs, but only on its own
+        return self.active == 0 or self.inflight_bytes + nbytes <= self.max_inflight_bytes
+
+    def _position(self, ticket):
+        for index, (waiting_ticket, _) in enumerate(self.waiting):
+            if waiting_ticket == ticket:
+                return index + 1
+        return 0
+
+    def _estimated_wait(self, position):
+        """Rough seconds until a file at this queue position starts"""
+        return position * self.avg_seconds / self.max_concurrent
+
+    def snapshot(self):
+        """Current load for display"""
+        with self.condition:
+            return {
+                'active': self.active,
+                'queued': len(self.waiting),
+                'inflight_mb': self.inflight_bytes / MB,
+                'max_concurrent': self.max_concurrent,
+                'completed': self.completed,
+            }
+
+    @contextmanager
+    def slot(self, nbytes, on_wait=None, poll_interval=0.5):
+        """Wait for a turn to convert `nbytes` of input; on_wait(position, seconds) reports progress"""
+        with self.condition:
+            ticket = next(self.tickets)
+            self.waiting.append((ticket, nbytes))
+        try:
+            while True:
+                with self.condition:
+                    if self.waiting[0][0] == ticket and self._can_admit(nbytes):
+                        self.waiting.popleft()
+                        self.active += 1
+                        self.inflight_bytes += nbytes
+                        # The next file in line may also fit
+                        self.condition.notify_all()
+                        break
+                    position = self._position(ticket)
+                    wait_seconds = self._estimated_wait(position)
+                # Report outside the lock so a slow UI update never blocks other sessions
+                if on_wait is not None:
+                    on_wait(position, wait_seconds)
+                with self.condition:
+                    if not (self.waiting[0][0] == ticket and self._can_admit(nbytes)):
+                        self.condition.wait(poll_interval)
+        except BaseException:
+            # The session stopped (rerun, disconnect) while queued
+            with self.condition:
+                if (ticket, nbytes) in self.waiting:
+                    self.waiting.remove((ticket, nbytes))
+                self.condition.notify_all()
+            raise
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.condition:
+                self.active -= 1
+                self.inflight_bytes -= nbytes
+                self.completed += 1
+                self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * elapsed
+                self.condition.notify_all()
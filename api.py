@@ -0,0 +1,315 @@
+"""Lightweight HTTP API for Excel to ASYCUDA XML conversion.
+
+Endpoints:
+    POST /convert?filename=NAME.xlsx   body = workbook  -> ASYCUDA XML (zip if it holds several declarations)
+    POST /convert?filename=NAME.zip    body = zip of workbooks -> zip of XML/error files, in the same folders
+    GET  /health                       -> JSON health and metrics
+
+Usage:
+    python api.py [--host 0.0.0.0] [--port 8000] [--workers 4] [--max-pending 16]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIServer, make_server
+from wsgiref.util import setup_testing_defaults
+
+from batch import convert_workbook_to_xmls, error_filename_for
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls', '.xlsm')
+MAX_UPLOAD_BYTES = int(os.environ.get('ASYCUDA_API_MAX_UPLOAD_MB', '200')) * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+class StreamBuffer:
+    """Write-only file object that zipfile writes into while the response drains it"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+class ReleasingResponse:
+    """Response body that frees its request slot when the server closes it"""
+
+    def __init__(self, body, release):
+        self.body = body
+        self.release = release
+        self.released = False
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+        if not self.released:
+            self.released = True
+            self.release()
+
+class Metrics:
+    """Thread-safe counters reported by the health endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.requests = 0
+        self.rejected = 0
+        self.active_requests = 0
+        self.files_converted = 0
+        self.files_failed = 0
+        self.latencies = deque(maxlen=1000)
+
+    def record_file(self, success, seconds):
+        with self.lock:
+            if success:
+                self.files_converted += 1
+            else:
+                self.files_failed += 1
+            self.latencies.append(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                'status': 'ok',
+                'uptime_seconds': round(time.time() - self.started_at, 1),
+                'requests': self.requests,
+                'rejected': self.rejected,
+                'active_requests': self.active_requests,
+                'files_converted': self.files_converted,
+                'files_failed': self.files_failed,
+                'latency_p50_seconds': round(latencies[len(latencies) // 2], 3) if latencies else 0,
+                'latency_max_seconds': round(latencies[-1], 3) if latencies else 0,
+            }
+
+def timed_convert(file_content, filename):
+    """Convert one workbook and report how long it took (runs inside a worker process)"""
+    started = time.perf_counter()
+    outputs = convert_workbook_to_xmls(file_content, filename)
+    return outputs, time.perf_counter() - started
+
+def write_outputs(zip_out, outputs, folder=''):
+    """Add a workbook's XML or error files to the response zip, under the workbook's folder"""
+    for output_name, success, result in outputs:
+        zip_out.writestr(folder + output_name, result if success else f"Conversion failed: {result}")
+
+def create_app(workers=None, max_pending=16):
+    """Build the WSGI application with its shared worker pool"""
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers)
+    pending = threading.BoundedSemaphore(max_pending)
+    metrics = Metrics()
+
+    def respond_json(start_response, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return [body]
+
+    def convert_workbook(file_content, filename):
+        outputs, seconds = pool.submit(timed_convert, file_content, filename).result()
+        metrics.record_file(all(success for _, success, _ in outputs), seconds)
+        return outputs
+
+    def stream_xml(xml_content):
+        data = xml_content.encode('utf-8')
+        for start in range(0, len(data), CHUNK_SIZE):
+            yield data[start:start + CHUNK_SIZE]
+
+    def stream_zip(archive):
+        """Convert every workbook in the archive, yielding the output zip as it is built"""
+        names = [n for n in archive.namelist()
+                 if n.lower().endswith(EXCEL_EXTENSIONS) and not os.path.basename(n).startswith(('.', '~$'))]
+        name_iter = iter(names)
+        in_flight = deque()
+
+        def submit_next():
+            name = next(name_iter, None)
+            if name is None:
+                return
+            filename = os.path.basename(name)
+            # Outputs keep the member's folder, so x/a.xlsx and y/a.xlsx do not both become a.xml
+            folder = name[:len(name) - len(filename)]
+            # The headers are already sent, so a bad member becomes an error file instead of a broken zip
+            try:
+                if archive.getinfo(name).file_size > MAX_UPLOAD_BYTES:
+                    raise ValueError(f"unpacks to more than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+                file_content = archive.read(name)
+            except (zipfile.BadZipFile, RuntimeError, ValueError, zlib.error, OSError) as e:
+                failed = Future()
+                failed.set_result(([(error_filename_for(filename), False, f"{filename} | Error: {str(e)}")], 0.0))
+                in_flight.append((filename, folder, failed))
+                return
+            in_flight.append((filename, folder, pool.submit(timed_convert, file_content, filename)))
+
+        # Keep at most `workers` members of this request in the pool at once
+        for _ in range(workers):
+            submit_next()
+
+        buffer = StreamBuffer()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_out:
+            while in_flight:
+                filename, folder, future = in_flight.popleft()
+                try:
+                    outputs, seconds = future.result()
+                except Exception as e:
+                    outputs, seconds = [(error_filename_for(filename), False, f"{filename} | Error: {str(e)}")], 0.0
+                metrics.record_file(all(success for _, success, _ in outputs), seconds)
+                write_outputs(zip_out, outputs, folder)
+                submit_next()
+                yield buffer.drain()
+        yield buffer.drain()
+
+    def stream_declarations(outputs):
+        """Zip the XML files of a workbook holding several declarations"""
+        buffer = StreamBuffer()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_out:
+            for output in outputs:
+                write_outputs(zip_out, [output])
+                yield buffer.drain()
+        yield buffer.drain()
+
+    def app(environ, start_response):
+        path = environ.get('PATH_INFO', '/')
+        method = environ.get('REQUEST_METHOD', 'GET')
+
+        if path == '/health' and method == 'GET':
+            return respond_json(start_response, '200 OK', dict(metrics.snapshot(), workers=workers))
+
+        if path != '/convert':
+            return respond_json(start_response, '404 Not Found', {'error': 'Not found'})
+        if method != 'POST':
+            return respond_json(start_response, '405 Method Not Allowed', {'error': 'Use POST'})
+
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        filename = os.path.basename(query.get('filename', [environ.get('HTTP_X_FILENAME', '')])[0])
+        if not filename.lower().endswith(EXCEL_EXTENSIONS + ('.zip',)):
+            return respond_json(start_response, '400 Bad Request',
+                                {'error': 'filename must end in .xlsx, .xls, .xlsm or .zip'})
+
+        try:
+            content_length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length <= 0:
+            return respond_json(start_response, '400 Bad Request', {'error': 'Empty request body'})
+        if content_length > MAX_UPLOAD_BYTES:
+            return respond_json(start_response, '413 Payload Too Large', {'error': 'Upload too large'})
+
+        with metrics.lock:
+            metrics.requests += 1
+        if not pending.acquire(blocking=False):
+            with metrics.lock:
+                metrics.rejected += 1
+            start_response('503 Service Unavailable', [('Content-Type', 'application/json'), ('Retry-After', '5')])
+            return [json.dumps({'error': 'Server busy, retry later'}).encode('utf-8')]
+
+        def release():
+            with metrics.lock:
+                metrics.active_requests -= 1
+            pending.release()
+
+        with metrics.lock:
+            metrics.active_requests += 1
+        try:
+            file_content = environ['wsgi.input'].read(content_length)
+
+            if filename.lower().endswith('.zip'):
+                try:
+                    archive = zipfile.ZipFile(BytesIO(file_content))
+                except zipfile.BadZipFile:
+                    release()
+                    return respond_json(start_response, '400 Bad Request', {'error': 'Invalid zip file'})
+                output_name = filename.rsplit('.', 1)[0] + '_ASYCUDA_XML.zip'
+                start_response('200 OK', [('Content-Type', 'application/zip'),
+                                          ('Content-Disposition', f'attachment; filename="{output_name}"')])
+                return ReleasingResponse(stream_zip(archive), release)
+
+            outputs = convert_workbook(file_content, filename)
+            failures = [result for _, success, result in outputs if not success]
+            if failures:
+                release()
+                return respond_json(start_response, '422 Unprocessable Entity', {'error': failures[0]})
+            if len(outputs) > 1:
+                output_name = filename.rsplit('.', 1)[0] + '_ASYCUDA_XML.zip'
+                start_response('200 OK', [('Content-Type', 'application/zip'),
+                                          ('Content-Disposition', f'attachment; filename="{output_name}"')])
+                return ReleasingResponse(stream_declarations(outputs), release)
+            xml_name, _, xml_content = outputs[0]
+            start_response('200 OK', [('Content-Type', 'application/xml; charset=utf-8'),
+                                      ('Content-Disposition', f'attachment; filename="{xml_name}"')])
+            return ReleasingResponse(stream_xml(xml_content), release)
+        except Exception as e:
+            release()
+            return respond_json(start_response, '500 Internal Server Error', {'error': str(e)})
+
+    app.pool = pool
+    app.metrics = metrics
+    return app
+
+def local_request(app, method, path, body=b''):
+    """Call the app in-process without a server and return (status, headers, body)"""
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = dict(headers)
+
+    result = app(environ, start_response)
+    try:
+        content = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], content
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API for Excel to ASYCUDA XML conversion")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=None, help="Number of conversion processes")
+    parser.add_argument('--max-pending', type=int, default=16, help="Requests accepted at once before answering 503")
+    args = parser.parse_args()
+
+    app = create_app(workers=args.workers, max_pending=args.max_pending)
+    with make_server(args.host, args.port, app, server_class=ThreadingWSGIServer) as server:
+        print(f"🚀 ASYCUDA XML API listening on http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("🛑 Stopping API...")
+        finally:
+            app.pool.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,6 @@ from xml.dom import minidom
 import os
 import warnings
 import streamlit as st
-import zipfile
 from io import BytesIO
 import tempfile
 import uuid
@@ -13,6 +12,20 @@ from datetime import datetime
 import base64
 from pathlib import Path
 import glob
+import difflib
+import re
+from functools import lru_cache
+from collections import Counter
+import openpyxl
+from concurrent.futures import ProcessPoolExecutor
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from session_manager import SessionResourceManager
+from admission import AdmissionController
+from profiling import BatchProfiler
+from contextlib import nullcontext
+from reference_data import lookup_name, is_known, is_known_commodity
+from volumes import VolumeWriter, MB
 
 # Suppress warnings
 warnings.filterwarnings('ignore')
@@ -51,6 +64,50 @@ CONSIGNMENT_VALUES = {
     'total_forms': '16'
 }
 
+# Columns read by create_asycuda_xml (SAD sheet) and create_item_element (Items sheet)
+SAD_COLUMNS = (
+    'Tax_code', 'Tax_description', 'Tax_mop', 'Sad_flow', 'Number_of_the_form', 'Selected_page',
+    'Customs_clearance_office_code', 'Customs_clearance_office_name', 'Type_of_declaration',
+    'General_procedure_code', 'Exporter_code', 'Exporter_name', 'Consignee_code', 'Consignee_name',
+    'Financial_code', 'Financial_name', 'Declarant_code', 'Declarant_name', 'Declarant_representative',
+    'Reference Year', 'Reference Number', 'Country_first_destination', 'Trading_country',
+    'Country_of_origin_name', 'Export_country_code', 'Export_country_name', 'Export_country_region',
+    'Destination_country_code', 'Destination_country_name', 'Destination_country_region', 'CAP',
+    'Location_of_goods', 'Location_of_goods_address', 'Departure_arrival_information Identity',
+    'Departure_arrival_information Nationality', 'Border_information Identity',
+    'Border_information Nationality', 'Border_information Mode', 'Delivery_terms Place',
+    'Border_office Code', 'Border_office Name', 'Place_of_loading Code', 'Place_of_loading Name',
+    'Deffered_payment_reference', 'Mode_of_payment', 'Financial_transaction Code_1', 'Bank Branch',
+    'Bank Reference', 'Terms Code', 'Terms Description', 'Amounts Global_taxes', 'Guarantee Amount',
+    'Result_of_control'
+)
+ITEM_COLUMNS = (
+    'Number_of_packages', 'Marks1_of_packages', 'Marks2_of_packages', 'Kind_of_packages_code',
+    'Kind_of_packages_name', 'Extended_customs_procedure', 'National_customs_procedure', 'Preference_code',
+    'Commodity_code', 'Precision_4', 'Supplementary_unit_code', 'Supplementary_unit_name_1',
+    'Supplementary_unit_quantity_1', 'Supplementary_unit_name_2', 'Supplementary_unit_quantity_2',
+    'Supplementary_unit_name_3', 'Supplementary_unit_quantity_3', 'Quota_code', 'Country_of_origin_code',
+    'Description_of_goods', 'Commercial_description', 'Gross_weight_itm', 'Net_weight_itm',
+    'Invoice Amount_foreign_currency', 'Summary_declaration', 'Summary_declaration_sl'
+)
+# Items column linking each item row to its SAD row in multi-declaration workbooks
+DECLARATION_KEY = 'Reference Number'
+# Code columns checked against the reference tables: (column, table)
+SAD_REFERENCE_CODES = (
+    ('Trading_country', 'countries'), ('Country_first_destination', 'countries'),
+    ('Export_country_code', 'countries'), ('Destination_country_code', 'countries'),
+    ('Customs_clearance_office_code', 'offices'), ('Border_office Code', 'offices'),
+)
+ITEM_REFERENCE_CODES = (
+    ('Country_of_origin_code', 'countries'), ('Kind_of_packages_code', 'package_kinds'),
+    ('Supplementary_unit_code', 'units'), ('Commodity_code', 'hs_codes'),
+)
+# Default size bound when the download is split into volumes
+DEFAULT_VOLUME_MB = 25
+
+# Columns whose absence silently falls back to the LV02 2025 6241 parties
+DEFAULTED_SAD_COLUMNS = ('Consignee_code', 'Consignee_name', 'Declarant_code', 'Declarant_name')
+
 # Custom CSS with Aruba Theme and Dashboard Style
 def set_aruba_theme():
     st.markdown("""
@@ -271,44 +328,162 @@ def set_aruba_theme():
     </style>
     """, unsafe_allow_html=True)
 
-def read_excel_data(file_content):
-    """Read Excel file with exact ASYCUDA structure"""
-    sad_data = {}
-    items_data = []
-    
+def normalize_header(header):
+    """Compare headers ignoring case, spaces and underscores"""
+    return re.sub(r'[^0-9a-z]', '', str(header).lower())
+
+def check_sheet_headers(sheet_name, headers, known_columns):
+    """Match one sheet's header row against the columns the XML builder reads"""
+    errors = []
+    warnings_found = []
+    present = set(headers)
+    by_normalized = {normalize_header(column): column for column in known_columns}
+
+    unknown = []
+    for header in headers:
+        if header in known_columns or header.startswith('Unnamed:'):
+            continue
+        # Same name apart from case, spaces or underscores: that data would be silently dropped
+        match = by_normalized.get(normalize_header(header))
+        if match is not None and match not in present:
+            errors.append(f"Column '{header}' in sheet '{sheet_name}' should be named '{match}'")
+            continue
+        # A similar name may be a typo, or a legitimate extra column, so it is only a warning
+        close = difflib.get_close_matches(header, known_columns, n=1, cutoff=0.85)
+        if close and close[0] not in present:
+            warnings_found.append(f"Column '{header}' in sheet '{sheet_name}' is not used in the XML "
+                                  f"(did you mean '{close[0]}'?)")
+        else:
+            unknown.append(header)
+
+    if not errors and not present & set(known_columns):
+        errors.append(f"Sheet '{sheet_name}' has none of the expected column names in its first row")
+    elif unknown:
+        warnings_found.append(f"Sheet '{sheet_name}' columns not used in the XML: {', '.join(unknown)}")
+    return errors, warnings_found
+
+@lru_cache(maxsize=256)
+def check_workbook_layout(sheet_names, sad_headers, item_headers):
+    """Validate a workbook layout; cached so files sharing a layout are checked once"""
+    errors = []
+    warnings_found = []
+
+    for sheet_name, headers, known_columns in (('SAD', sad_headers, SAD_COLUMNS),
+                                                     ('Items', item_headers, ITEM_COLUMNS + (DECLARATION_KEY,))):
+        if headers is None:
+            similar = [name for name in sheet_names if name.strip().lower() == sheet_name.lower()]
+            hint = f" (found '{similar[0]}', sheet names are case-sensitive)" if similar else ""
+            errors.append(f"Missing sheet '{sheet_name}'{hint}")
+            continue
+        sheet_errors, sheet_warnings = check_sheet_headers(sheet_name, headers, known_columns)
+        errors.extend(sheet_errors)
+        warnings_found.extend(sheet_warnings)
+
+    if sad_headers is not None:
+        missing = [column for column in DEFAULTED_SAD_COLUMNS if column not in sad_headers]
+        if missing:
+            warnings_found.append(f"Missing SAD columns, consignment defaults used: {', '.join(missing)}")
+
+    return tuple(errors), tuple(warnings_found)
+
+def read_header_row(sheet):
+    """Header names of a sheet as pandas will see them (first row only)"""
+    first_row = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+    return tuple(str(value) if value is not None else f"Unnamed: {i}" for i, value in enumerate(first_row))
+
+def preflight_workbook(file_content, filename):
+    """Check sheet names and header rows without parsing the data; returns (errors, warnings)"""
+    # openpyxl cannot read legacy .xls files, those go straight to the full conversion
+    if filename.lower().endswith('.xls'):
+        return [], []
+
     try:
-        # Read SAD sheet
-        try:
-            sad_df = pd.read_excel(BytesIO(file_content), sheet_name='SAD')
-            if not sad_df.empty:
-                sad_row = sad_df.iloc[0]
-                for col in sad_df.columns:
-                    if pd.notna(sad_row[col]):
-                        sad_data[col] = str(sad_row[col])
-                    else:
-                        sad_data[col] = ''
-        except Exception as e:
-            st.warning(f"Warning reading SAD sheet: {str(e)}")
-        
-        # Read Items sheet
-        try:
-            items_df = pd.read_excel(BytesIO(file_content), sheet_name='Items')
-            if not items_df.empty:
-                for _, row in items_df.iterrows():
-                    item = {}
-                    for col in items_df.columns:
-                        if pd.notna(row[col]):
-                            item[col] = str(row[col])
-                        else:
-                            item[col] = ''
-                    items_data.append(item)
-        except Exception as e:
-            st.warning(f"Warning reading Items sheet: {str(e)}")
-        
+        workbook = openpyxl.load_workbook(BytesIO(file_content), read_only=True, data_only=True)
     except Exception as e:
-        st.error(f"Error reading file: {str(e)}")
-    
-    return sad_data, items_data
+        return [f"Not a readable Excel workbook: {str(e)}"], []
+
+    try:
+        sheet_names = tuple(workbook.sheetnames)
+        sad_headers = read_header_row(workbook['SAD']) if 'SAD' in sheet_names else None
+        item_headers = read_header_row(workbook['Items']) if 'Items' in sheet_names else None
+    finally:
+        workbook.close()
+
+    errors, warnings_found = check_workbook_layout(sheet_names, sad_headers, item_headers)
+    return list(errors), list(warnings_found)
+
+def frame_to_records(df):
+    """Rows of a sheet as dicts of strings, with empty cells as ''"""
+    # str() of each cell as read, so dates keep their time ('2025-03-01 00:00:00') like the row-by-row reader did
+    records = df.astype(object).where(df.notna(), '').to_dict('records')
+    return [{column: str(value) for column, value in row.items()} for row in records]
+
+def declaration_reference(value):
+    """Reference number as text, so 123 and 123.0 refer to the same declaration"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return '' if pd.isna(value) else str(value).strip()
+
+def read_excel_declarations(file_content):
+    """Parse a workbook once and split it into (reference, sad_data, items_data) per SAD row"""
+    sheets = pd.read_excel(BytesIO(file_content), sheet_name=['SAD', 'Items'])
+    sad_df, items_df = sheets['SAD'], sheets['Items']
+    sad_rows = frame_to_records(sad_df)
+    item_rows = frame_to_records(items_df)
+    
+    # A single SAD row, or no key linking items to SAD rows: the workbook is one declaration
+    if len(sad_rows) <= 1 or DECLARATION_KEY not in sad_df.columns or DECLARATION_KEY not in items_df.columns:
+        return [('', sad_rows[0] if sad_rows else {}, item_rows)]
+    
+    sad_references = sad_df[DECLARATION_KEY].map(declaration_reference).tolist()
+    duplicates = sorted(ref for ref, count in Counter(sad_references).items() if count > 1)
+    if duplicates:
+        raise ValueError(f"Duplicate {DECLARATION_KEY} in SAD sheet: {', '.join(duplicates)}")
+    if '' in sad_references:
+        raise ValueError(f"SAD row {sad_references.index('') + 2} has no {DECLARATION_KEY}")
+    
+    # Rows are numbered as in Excel: the header is row 1
+    item_references = items_df[DECLARATION_KEY].map(declaration_reference)
+    blank_rows = [str(position + 2) for position, ref in enumerate(item_references) if ref == '']
+    if blank_rows:
+        raise ValueError(f"Items rows {', '.join(blank_rows)} have no {DECLARATION_KEY}")
+    
+    # Partition all item rows in one group-by instead of filtering once per declaration
+    item_groups = items_df.groupby(item_references, sort=False).indices
+    orphans = sorted(set(item_groups) - set(sad_references))
+    if orphans:
+        raise ValueError(f"Items reference {DECLARATION_KEY} not found in SAD sheet: {', '.join(orphans)}")
+    
+    return [
+        (reference, sad_data, [item_rows[position] for position in item_groups.get(reference, [])])
+        for reference, sad_data in zip(sad_references, sad_rows)
+    ]
+
+def reference_name(data, name_column, table_name, code):
+    """Name from the sheet's column (even if blank), or looked up from its code when the sheet has no such column"""
+    if name_column in data:
+        return data[name_column]
+    return lookup_name(table_name, code)
+
+def check_reference_codes(sad_data, items_data):
+    """Warnings for codes missing from the reference tables (only tables marked complete are checked)"""
+    unknown = {}
+    rows = [(sad_data, SAD_REFERENCE_CODES)] + [(item, ITEM_REFERENCE_CODES) for item in items_data]
+    for data, columns in rows:
+        for column, table_name in columns:
+            code = data.get(column, '')
+            if not code:
+                continue
+            known = is_known_commodity(code) if table_name == 'hs_codes' else is_known(table_name, code)
+            if known is False:
+                unknown.setdefault(column, []).append(code)
+    
+    warnings_found = []
+    for column, codes in unknown.items():
+        codes = list(dict.fromkeys(codes))
+        more = f" and {len(codes) - 5} more" if len(codes) > 5 else ""
+        warnings_found.append(f"Unknown {column}: {', '.join(codes[:5])}{more}")
+    return warnings_found
 
 def calculate_form_totals(items_data):
     """Calculate form-specific totals (per XML file)"""
@@ -385,8 +560,9 @@ def create_item_supplementary_unit(parent, item_data, unit_num):
     
     if unit_num == '1':
         add_element(supp_unit, "Supplementary_unit_rank", "")
-        add_element(supp_unit, "Supplementary_unit_code", item_data.get('Supplementary_unit_code', 'PCE'))
-        add_element(supp_unit, "Supplementary_unit_name", item_data.get('Supplementary_unit_name_1', 'Aantal Stucks'))
+        unit_code = item_data.get('Supplementary_unit_code', 'PCE')
+        add_element(supp_unit, "Supplementary_unit_code", unit_code)
+        add_element(supp_unit, "Supplementary_unit_name", reference_name(item_data, 'Supplementary_unit_name_1', 'units', unit_code))
         add_element(supp_unit, "Supplementary_unit_quantity", item_data.get('Supplementary_unit_quantity_1', ''))
     elif unit_num == '2':
         add_element(supp_unit, "Supplementary_unit_rank", "2")
@@ -456,8 +632,9 @@ def create_item_element(parent, item_data, item_number):
     add_element(packages, "Number_of_packages", item_data.get('Number_of_packages', ''))
     add_element(packages, "Marks1_of_packages", item_data.get('Marks1_of_packages', ''))
     add_element(packages, "Marks2_of_packages", item_data.get('Marks2_of_packages', ''))
-    add_element(packages, "Kind_of_packages_code", item_data.get('Kind_of_packages_code', 'STKS'))
-    add_element(packages, "Kind_of_packages_name", item_data.get('Kind_of_packages_name', 'Stuks'))
+    packages_code = item_data.get('Kind_of_packages_code', 'STKS')
+    add_element(packages, "Kind_of_packages_code", packages_code)
+    add_element(packages, "Kind_of_packages_name", reference_name(item_data, 'Kind_of_packages_name', 'package_kinds', packages_code))
     
     # Tariff section
     tariff = ET.SubElement(item, "Tariff")
@@ -552,8 +729,9 @@ def create_asycuda_xml(sad_data, items_data, filename):
     add_element(identification, "Manifest_reference_number", CONSIGNMENT_VALUES['manifest_reference'])
     
     office_segment = ET.SubElement(identification, "Office_segment")
-    add_element(office_segment, "Customs_clearance_office_code", sad_data.get('Customs_clearance_office_code', 'LV01'))
-    add_element(office_segment, "Customs_clearance_office_name", sad_data.get('Customs_clearance_office_name', 'Luchthaven Vracht'))
+    office_code = sad_data.get('Customs_clearance_office_code', 'LV01')
+    add_element(office_segment, "Customs_clearance_office_code", office_code)
+    add_element(office_segment, "Customs_clearance_office_name", reference_name(sad_data, 'Customs_clearance_office_name', 'offices', office_code))
     
     type_elem = ET.SubElement(identification, "Type")
     add_element(type_elem, "Type_of_declaration", sad_data.get('Type_of_declaration', 'INV'))
@@ -589,17 +767,20 @@ def create_asycuda_xml(sad_data, items_data, filename):
     
     country = ET.SubElement(general_info, "Country")
     add_element(country, "Country_first_destination", sad_data.get('Country_first_destination', 'US'))
-    add_element(country, "Trading_country", sad_data.get('Trading_country', 'US'))
-    add_element(country, "Country_of_origin_name", sad_data.get('Country_of_origin_name', 'Verenigde Staten'))
+    trading_country = sad_data.get('Trading_country', 'US')
+    add_element(country, "Trading_country", trading_country)
+    add_element(country, "Country_of_origin_name", reference_name(sad_data, 'Country_of_origin_name', 'countries', trading_country))
     
     export = ET.SubElement(country, "Export")
-    add_element(export, "Export_country_code", sad_data.get('Export_country_code', 'US'))
-    add_element(export, "Export_country_name", sad_data.get('Export_country_name', 'Verenigde Staten'))
+    export_country = sad_data.get('Export_country_code', 'US')
+    add_element(export, "Export_country_code", export_country)
+    add_element(export, "Export_country_name", reference_name(sad_data, 'Export_country_name', 'countries', export_country))
     add_element(export, "Export_country_region", sad_data.get('Export_country_region', ''))
     
     destination = ET.SubElement(country, "Destination")
-    add_element(destination, "Destination_country_code", sad_data.get('Destination_country_code', 'AW'))
-    add_element(destination, "Destination_country_name", sad_data.get('Destination_country_name', 'Aruba'))
+    destination_country = sad_data.get('Destination_country_code', 'AW')
+    add_element(destination, "Destination_country_code", destination_country)
+    add_element(destination, "Destination_country_name", reference_name(sad_data, 'Destination_country_name', 'countries', destination_country))
     add_element(destination, "Destination_country_region", sad_data.get('Destination_country_region', ''))
     
     add_element(general_info, "Value_details", CONSIGNMENT_VALUES['total_cost'])
@@ -627,8 +808,9 @@ def create_asycuda_xml(sad_data, items_data, filename):
     add_element(delivery, "Place", sad_data.get('Delivery_terms Place', 'USA'))
     
     border_office = ET.SubElement(transport, "Border_office")
-    add_element(border_office, "Code", sad_data.get('Border_office Code', 'LV01'))
-    add_element(border_office, "Name", sad_data.get('Border_office Name', 'Luchthaven Vracht'))
+    border_office_code = sad_data.get('Border_office Code', 'LV01')
+    add_element(border_office, "Code", border_office_code)
+    add_element(border_office, "Name", reference_name(sad_data, 'Border_office Name', 'offices', border_office_code))
     
     place_loading = ET.SubElement(transport, "Place_of_loading")
     add_element(place_loading, "Code", sad_data.get('Place_of_loading Code', 'AWAIR'))
@@ -690,25 +872,467 @@ def prettify_xml(elem):
     reparsed = minidom.parseString(rough_string)
     return reparsed.toprettyxml(indent="  ")
 
-def convert_excel_to_xml(file_content, filename):
-    """Convert single Excel file to ASYCUDA XML"""
+def xml_filename_for(filename):
+    """Name of the XML file generated from an Excel file"""
+    return filename.rsplit('.', 1)[0] + '.xml'
+
+def error_filename_for(filename):
+    """Name of the error report written when an Excel file fails to convert"""
+    return filename + '_ERROR.txt'
+
+def declaration_filename(filename, reference):
+    """Name of the XML file for one declaration of a multi-declaration workbook"""
+    safe_reference = re.sub(r'[^0-9A-Za-z_-]+', '_', reference).strip('_')
+    return filename.rsplit('.', 1)[0] + f'_{safe_reference}.xml'
+
+def declaration_filenames(filename, references):
+    """Unique XML file names for the declarations of a workbook
+    
+    References such as 'A/1' and 'A_1' sanitize to the same name, and names that
+    differ only in case clash on Windows, so later ones get a numbered suffix.
+    """
+    names = []
+    used = set()
+    for reference in references:
+        name = declaration_filename(filename, reference)
+        stem = name[:-len('.xml')]
+        number = 1
+        while name.lower() in used:
+            number += 1
+            name = f"{stem}_{number}.xml"
+        used.add(name.lower())
+        names.append(name)
+    return names
+
+def build_declaration_xml(sad_data, items_data, filename):
+    """Generate the XML text of one declaration"""
+    return prettify_xml(create_asycuda_xml(sad_data, items_data, filename))
+
+def convert_workbook_to_xmls(file_content, filename, preflight=True, workers=1, issues=None):
+    """Convert a workbook holding one or many declarations; returns [(output_name, success, result)]
+    
+    workers > 1 builds the declarations in a process pool, which needs batch to be
+    importable as a module (the watcher, the API, scripts), not the Streamlit page.
+    Codes missing from the reference tables are appended to `issues` when a list is given.
+    """
     try:
-        # Read data from Excel
-        sad_data, items_data = read_excel_data(file_content)
-        
-        if not sad_data and not items_data:
-            return False, f"No valid data found in {filename}"
+        if preflight:
+            errors, _ = preflight_workbook(file_content, filename)
+            if errors:
+                return [(error_filename_for(filename), False, f"{filename} | Preflight failed: {'; '.join(errors)}")]
         
-        # Create XML structure
-        xml_root = create_asycuda_xml(sad_data, items_data, filename)
+        declarations = read_excel_declarations(file_content)
+        if issues is not None:
+            for _, sad_data, items_data in declarations:
+                issues.extend(check_reference_codes(sad_data, items_data))
         
-        # Generate XML content
-        xml_content = prettify_xml(xml_root)
+        if len(declarations) == 1:
+            _, sad_data, items_data = declarations[0]
+            if not sad_data and not items_data:
+                return [(error_filename_for(filename), False, f"No valid data found in {filename}")]
+            return [(xml_filename_for(filename), True, build_declaration_xml(sad_data, items_data, filename))]
         
-        return True, xml_content
+        output_names = declaration_filenames(filename, [reference for reference, _, _ in declarations])
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                xml_contents = list(pool.map(
+                    build_declaration_xml,
+                    [sad_data for _, sad_data, _ in declarations],
+                    [items_data for _, _, items_data in declarations],
+                    [filename] * len(declarations)
+                ))
+        else:
+            xml_contents = [build_declaration_xml(sad_data, items_data, filename)
+                            for _, sad_data, items_data in declarations]
+        return [(name, True, content) for name, content in zip(output_names, xml_contents)]
         
     except Exception as e:
-        return False, f"{filename} | Error: {str(e)}"
+        return [(error_filename_for(filename), False, f"{filename} | Error: {str(e)}")]
+
+def convert_excel_to_xml(file_content, filename, preflight=True):
+    """Convert single Excel file to ASYCUDA XML"""
+    outputs = convert_workbook_to_xmls(file_content, filename, preflight=preflight)
+    if len(outputs) > 1:
+        return False, f"{filename} | Error: holds {len(outputs)} declarations, use convert_workbook_to_xmls"
+    _, success, result = outputs[0]
+    return success, result
+
+def is_session_open(session_id):
+    """Whether a browser session is still connected, and so still holds its uploaded files"""
+    return runtime.exists() and runtime.get_instance().is_active_session(session_id)
+
+@st.cache_resource
+def get_session_manager():
+    """Process-wide tracker of the memory held by each browser session"""
+    return SessionResourceManager(is_session_open=is_session_open)
+
+@st.cache_resource
+def get_admission_controller():
+    """Process-wide queue that limits conversions running across all sessions"""
+    return AdmissionController()
+
+def current_session():
+    """Session resource manager and this session's id, marking the session as active"""
+    session_manager = get_session_manager()
+    session_id = st.session_state.session_id
+    session_manager.touch(session_id)
+    return session_manager, session_id
+
+@st.fragment
+def file_selection_panel():
+    """File uploaders and summary; reruns on its own when files are added or removed"""
+    session_manager, session_id = current_session()
+    generation = st.session_state.uploader_generation
+    
+    # File Selection Section
+    st.header("📁 File Selection")
+    
+    # File Selection Methods in Tabs
+    tab1, tab2 = st.tabs(["📄 Individual Files", "📁 Upload Folder"])
+    
+    with tab1:
+        st.subheader("Select Individual Excel Files")
+        individual_files = st.file_uploader(
+            "Choose Excel files",
+            type=["xlsx", "xls", "xlsm"],
+            accept_multiple_files=True,
+            key=f"individual_files_{generation}",
+            help="Select multiple Excel files for conversion"
+        )
+        
+        if individual_files:
+            st.success(f"✅ {len(individual_files)} individual file(s) selected")
+    
+    with tab2:
+        st.subheader("Upload Folder with Excel Files")
+        st.info("💡 Select multiple Excel files from your folder (works on both local and cloud)")
+        
+        # Multiple file selection for folder upload
+        folder_files = st.file_uploader(
+            "Select ALL Excel files from your folder",
+            type=["xlsx", "xls", "xlsm"],
+            accept_multiple_files=True,
+            key=f"folder_files_{generation}",
+            help="Hold Ctrl/Cmd to select multiple files, or drag and drop all files from your folder"
+        )
+        
+        if folder_files:
+            st.success(f"✅ {len(folder_files)} file(s) selected from folder")
+            st.info(f"📁 Folder upload complete! Found {len(folder_files)} Excel files")
+    
+    # Combine all files
+    all_files = []
+    if individual_files:
+        all_files.extend(individual_files)
+    if folder_files:
+        all_files.extend(folder_files)
+    
+    # Remove duplicates
+    unique_files = []
+    seen_files = set()
+    for file in all_files:
+        file_id = (file.name, getattr(file, 'size', 0))
+        if file_id not in seen_files:
+            seen_files.add(file_id)
+            unique_files.append(file)
+    
+    # Update session state
+    total_size = sum(getattr(file, 'size', 0) for file in unique_files)
+    st.session_state.all_files = unique_files
+    st.session_state.upload_error = session_manager.track_uploads(session_id, total_size)
+    
+    # The conversion panel only depends on whether files are selected and within limits,
+    # so the whole page reruns only when that changes
+    selection = (bool(unique_files), st.session_state.upload_error)
+    rendered_selection = st.session_state.get('rendered_selection')
+    if rendered_selection is not None and rendered_selection != selection:
+        # Record it first, or this check would fail again in the full rerun and loop forever
+        st.session_state.rendered_selection = selection
+        st.rerun()
+    
+    # Display file summary
+    if st.session_state.all_files:
+        st.markdown("---")
+        st.subheader("📋 Selected Files Summary")
+        
+        with st.expander("View File Details", expanded=True):
+            for i, file in enumerate(st.session_state.all_files[:15]):  # Show first 15
+                file_size = getattr(file, 'size', 0)
+                size_mb = file_size / (1024 * 1024) if file_size > 0 else 0
+                st.write(f"**{i+1}.** `{file.name}` ({size_mb:.1f} MB)")
+            
+            if len(st.session_state.all_files) > 15:
+                st.write(f"... and {len(st.session_state.all_files) - 15} more files")
+            
+            st.write(f"**Total Size:** {total_size / (1024 * 1024):.1f} MB")
+    
+    else:
+        st.info("📝 No files selected yet. Use the tabs above to select files.")
+
+def artifact_download_button(session_manager, session_id, artifact_key, label, file_name, mime,
+                             primary=True, key=None):
+    """Download button that loads a stored artifact only when clicked and does not rerun the page
+    
+    The button is disabled once the artifact has been evicted, instead of serving an empty file.
+    """
+    available = session_manager.has(session_id, artifact_key)
+    st.download_button(
+        label=label,
+        data=lambda: session_manager.get(session_id, artifact_key) or b'',
+        file_name=file_name,
+        mime=mime,
+        on_click="ignore",
+        use_container_width=True,
+        type="primary" if primary else "secondary",
+        disabled=not available,
+        key=key
+    )
+    return available
+
+def volume_download_button(session_manager, session_id, volume, label, key=None):
+    """Download button for one zip volume of the results"""
+    return artifact_download_button(session_manager, session_id, volume['key'], label,
+                                    volume['file_name'], "application/zip", key=key)
+
+def run_conversion(files, session_manager, session_id, profile=False, stage_timing=False,
+                   volume_mb=None, volume_workbooks=None):
+    """Convert the selected files into the session's output zip, showing progress; returns the results summary
+    
+    With volume_mb or volume_workbooks the output is split into zip volumes, each
+    offered for download as soon as it is finalised.
+    """
+    admission = get_admission_controller()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    split = bool(volume_mb or volume_workbooks)
+    
+    st.markdown("---")
+    st.subheader("🔄 Conversion Progress")
+    
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    volumes_ready = st.container()
+    
+    successful_conversions = 0
+    failed_conversions = 0
+    conversion_log = []
+    
+    # A profile of the batch can be sent to support instead of the confidential workbooks
+    profiler = BatchProfiler(globals(), stage_timing=stage_timing) if profile else None
+    
+    def file_name_for(number):
+        if split:
+            return f"ASYCUDA_XML_Output_{timestamp}_part{number:03d}.zip"
+        return f"ASYCUDA_XML_Output_{timestamp}.zip"
+    
+    def time_zip_writes(zip_file):
+        if profiler is not None:
+            profiler.time_method(zip_file, 'writestr', 'zip_write')
+    
+    def show_volume(volume):
+        session_manager.touch(session_id)
+        with volumes_ready:
+            volume_download_button(session_manager, session_id, volume,
+                                   f"📥 Volume {volume['number']} ready ({len(volume['workbooks'])} workbooks)",
+                                   key=f"early_volume_{timestamp}_{volume['number']}")
+    
+    # Build the zip volumes in spools that move to disk once they grow large
+    session_manager.release(session_id)
+    writer = VolumeWriter(session_manager, session_id, file_name_for,
+                          max_bytes=int(volume_mb * MB) if volume_mb else None, max_workbooks=volume_workbooks,
+                          on_open=time_zip_writes, on_finalised=show_volume if split else None)
+    
+    with writer:
+        total_files = len(files)
+        
+        with profiler or nullcontext():
+            for i, file in enumerate(files):
+                # A long batch must not look idle, or its finished volumes would be evicted
+                session_manager.touch(session_id)
+                
+                # Update progress
+                progress = (i / total_files)
+                progress_bar.progress(progress)
+                status_text.text(f"🔄 Processing {i+1}/{total_files}: {file.name}")
+                
+                def show_queue_position(position, wait_seconds):
+                    status_text.text(f"⏳ Server busy: {file.name} is #{position} in the queue "
+                                     f"(about {wait_seconds:.0f}s wait)")
+                
+                # Convert file once the shared queue admits it
+                try:
+                    with admission.slot(getattr(file, 'size', 0), on_wait=show_queue_position):
+                        status_text.text(f"🔄 Processing {i+1}/{total_files}: {file.name}")
+                        file.seek(0)
+                        file_content = file.read()
+                        errors, preflight_warnings = preflight_workbook(file_content, file.name)
+                        if errors:
+                            outputs = [(error_filename_for(file.name), False,
+                                        f"Preflight failed: {'; '.join(errors)}")]
+                        else:
+                            outputs = convert_workbook_to_xmls(file_content, file.name, preflight=False,
+                                                               issues=preflight_warnings)
+                    
+                    for warning in preflight_warnings:
+                        conversion_log.append(f"⚠️ CHECK: {file.name} - {warning}")
+                    failures = [result for _, success, result in outputs if not success]
+                    # All outputs of a workbook go into the same volume
+                    writer.add(file.name, [(output_name, result if success else f"Conversion failed: {result}")
+                                           for output_name, success, result in outputs],
+                               'failed' if failures else 'converted')
+                    
+                    if not failures:
+                        successful_conversions += 1
+                        declarations = f" ({len(outputs)} declarations)" if len(outputs) > 1 else ""
+                        conversion_log.append(f"✅ SUCCESS: {file.name}{declarations}")
+                    else:
+                        failed_conversions += 1
+                        conversion_log.append(f"❌ FAILED: {file.name} - {failures[0]}")
+                        
+                except Exception as e:
+                    error_filename = error_filename_for(file.name)
+                    writer.add(file.name, [(error_filename, f"Unexpected error: {str(e)}")], 'error')
+                    failed_conversions += 1
+                    conversion_log.append(f"💥 ERROR: {file.name} - {str(e)}")
+                
+                # Small delay for smooth progress animation, left out of a profiled batch's timings
+                if profiler is None:
+                    time.sleep(0.1)
+            
+        if profiler is not None:
+            profile_entries = profiler.archive_entries()
+            writer.append('', profile_entries, 'profile')
+            profile_files = [path for path, _ in profile_entries]
+            if not profiler.profiled:
+                conversion_log.append("🧪 PROFILE: skipped, another batch was being profiled at the same time")
+            conversion_log.append(f"🧪 PROFILE: {' and '.join(profile_files)} added to the archive")
+        
+        # Final progress update
+        progress_bar.progress(1.0)
+        status_text.text("✅ Conversion completed!")
+    
+    # Which workbook went to which volume
+    if split:
+        session_manager.put(session_id, 'volume_manifest', writer.manifest_csv().encode('utf-8'))
+        conversion_log.append(f"📦 VOLUMES: output split into {len(writer.volumes)} zip volumes")
+    
+    return {
+        'total_files': total_files,
+        'successful': successful_conversions,
+        'failed': failed_conversions,
+        'log': conversion_log,
+        'timestamp': timestamp,
+        'volumes': writer.volumes,
+        'split': split,
+    }
+
+@st.fragment
+def conversion_panel():
+    """Start button and progress; a conversion reruns only this panel until it finishes"""
+    session_manager, session_id = current_session()
+    admission = get_admission_controller()
+    files = st.session_state.all_files
+    upload_error = st.session_state.get('upload_error')
+    st.session_state.rendered_selection = (bool(files), upload_error)
+    
+    # Conversion button
+    start_conversion = False
+    if upload_error:
+        st.button("✅ START CONVERSION", use_container_width=True, disabled=True)
+        st.error(f"🚫 {upload_error}")
+    elif files:
+        start_conversion = st.button("✅ START CONVERSION", use_container_width=True, type="primary")
+    else:
+        st.button("✅ START CONVERSION", use_container_width=True, disabled=True)
+        st.warning("Please select files to enable conversion")
+    
+    load = admission.snapshot()
+    st.caption(f"Server load: {load['active']}/{load['max_concurrent']} conversions running, "
+               f"{load['queued']} file(s) queued")
+    
+    # Diagnostics for slow batches
+    profile = st.toggle("🧪 Profile this batch", key="profile_batch",
+                        help="Adds a cProfile .pstats file and a text summary to the download, "
+                             "so a slow batch can be analysed without sharing the workbooks")
+    stage_timing = profile and st.checkbox("Also time each conversion stage", key="profile_stage_timing",
+                                           help="Measures wall time per stage; adds a little overhead")
+    
+    # Large batches can be downloaded in parts while the rest is still converting
+    volume_mb = volume_workbooks = None
+    if st.toggle("📦 Split download into volumes", key="split_volumes",
+                 help="Each volume can be downloaded as soon as it is full; a manifest lists which "
+                      "workbook went to which volume"):
+        volume_mb = st.number_input("Max MB per volume (0 = no limit)", min_value=0, value=DEFAULT_VOLUME_MB,
+                                    key="volume_max_mb") or None
+        volume_workbooks = st.number_input("Max workbooks per volume (0 = no limit)", min_value=0, value=0,
+                                           key="volume_max_workbooks") or None
+    
+    if start_conversion:
+        st.session_state.conversion_results = run_conversion(
+            files, session_manager, session_id, profile=profile, stage_timing=stage_timing,
+            volume_mb=volume_mb, volume_workbooks=volume_workbooks
+        )
+        # Show the results panel
+        st.rerun()
+
+@st.fragment
+def results_panel():
+    """Results summary and download, kept in session state so they survive reruns"""
+    results = st.session_state.get('conversion_results')
+    if not results:
+        return
+    session_manager, session_id = current_session()
+    total_files = results['total_files']
+    
+    # Results summary
+    st.markdown("---")
+    st.subheader("📊 Conversion Results")
+    
+    # Metrics in columns
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Total Files", total_files)
+    with col2:
+        st.metric("Successful", results['successful'])
+    with col3:
+        st.metric("Failed", results['failed'])
+    
+    # Success rate
+    success_rate = (results['successful'] / total_files * 100) if total_files > 0 else 0
+    st.metric("Success Rate", f"{success_rate:.1f}%")
+    
+    # Conversion log
+    with st.expander("View Conversion Log", expanded=True):
+        log_content = "\n".join(results['log'])
+        st.text_area("Conversion Log", log_content, height=150, key=f"conversion_log_{results['timestamp']}")
+    
+    # Download buttons (a zip is only loaded when clicked and nothing reruns)
+    if results['split']:
+        available = [artifact_download_button(
+            session_manager, session_id, 'volume_manifest', "🧾 DOWNLOAD VOLUME MANIFEST (CSV)",
+            f"ASYCUDA_XML_Output_{results['timestamp']}_manifest.csv", "text/csv", primary=False
+        )]
+        for volume in results['volumes']:
+            available.append(volume_download_button(
+                session_manager, session_id, volume,
+                f"📥 VOLUME {volume['number']}/{len(results['volumes'])} "
+                f"({len(volume['workbooks'])} workbooks, {volume['size'] / MB:.1f} MB)"
+            ))
+    else:
+        available = [volume_download_button(session_manager, session_id, results['volumes'][0],
+                                            "📥 DOWNLOAD ASYCUDA XML FILES (ZIP)")]
+    if not all(available):
+        st.warning("⌛ These results expired after the session was idle. Please convert the files again.")
+    
+    # Clear files and results
+    if st.button("🔄 Start New Conversion", use_container_width=True):
+        st.session_state.all_files = []
+        st.session_state.conversion_results = None
+        st.session_state.upload_error = None
+        st.session_state.rendered_selection = (False, None)
+        # New uploader keys empty the file selection
+        st.session_state.uploader_generation += 1
+        session_manager.release(session_id)
+        st.rerun()
 
 def main():
     # Set Aruba theme
@@ -721,89 +1345,18 @@ def main():
     # Initialize session state for files
     if 'all_files' not in st.session_state:
         st.session_state.all_files = []
+    if 'session_id' not in st.session_state:
+        # Streamlit's own id, so the session manager can tell when the browser session is gone
+        ctx = get_script_run_ctx()
+        st.session_state.session_id = ctx.session_id if ctx else str(uuid.uuid4())
+    if 'uploader_generation' not in st.session_state:
+        st.session_state.uploader_generation = 0
     
     # Dashboard Layout - Side by Side
     col1, col2 = st.columns([1, 1], gap="medium")
     
     with col1:
-        # File Selection Section
-        st.header("📁 File Selection")
-        
-        # File Selection Methods in Tabs
-        tab1, tab2 = st.tabs(["📄 Individual Files", "📁 Upload Folder"])
-        
-        with tab1:
-            st.subheader("Select Individual Excel Files")
-            individual_files = st.file_uploader(
-                "Choose Excel files",
-                type=["xlsx", "xls", "xlsm"],
-                accept_multiple_files=True,
-                key="individual_files",
-                help="Select multiple Excel files for conversion"
-            )
-            
-            if individual_files:
-                st.success(f"✅ {len(individual_files)} individual file(s) selected")
-        
-        with tab2:
-            st.subheader("Upload Folder with Excel Files")
-            st.info("💡 Select multiple Excel files from your folder (works on both local and cloud)")
-            
-            # Multiple file selection for folder upload
-            folder_files = st.file_uploader(
-                "Select ALL Excel files from your folder",
-                type=["xlsx", "xls", "xlsm"],
-                accept_multiple_files=True,
-                key="folder_files",
-                help="Hold Ctrl/Cmd to select multiple files, or drag and drop all files from your folder"
-            )
-            
-            if folder_files:
-                st.success(f"✅ {len(folder_files)} file(s) selected from folder")
-                st.info(f"📁 Folder upload complete! Found {len(folder_files)} Excel files")
-        
-        # Combine all files
-        all_files = []
-        if individual_files:
-            all_files.extend(individual_files)
-        if folder_files:
-            all_files.extend(folder_files)
-        
-        # Remove duplicates
-        unique_files = []
-        seen_files = set()
-        for file in all_files:
-            file_id = (file.name, getattr(file, 'size', 0))
-            if file_id not in seen_files:
-                seen_files.add(file_id)
-                unique_files.append(file)
-        
-        # Update session state
-        st.session_state.all_files = unique_files
-        
-        # Display file summary
-        if st.session_state.all_files:
-            st.markdown("---")
-            st.subheader("📋 Selected Files Summary")
-            
-            # File management buttons
-            
-            
-            with st.expander("View File Details", expanded=True):
-                total_size = 0
-                for i, file in enumerate(st.session_state.all_files[:15]):  # Show first 15
-                    file_size = getattr(file, 'size', 0)
-                    total_size += file_size
-                    size_mb = file_size / (1024 * 1024) if file_size > 0 else 0
-                    st.write(f"**{i+1}.** `{file.name}` ({size_mb:.1f} MB)")
-                
-                if len(st.session_state.all_files) > 15:
-                    st.write(f"... and {len(st.session_state.all_files) - 15} more files")
-                
-                st.write(f"**Total Size:** {total_size / (1024 * 1024):.1f} MB")
-        
-        else:
-            st.info("📝 No files selected yet. Use the tabs above to select files.")
+        file_selection_panel()
     
     with col2:
         # Conversion Control Section
@@ -821,109 +1374,8 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
-        # Conversion button
-        if st.session_state.all_files:
-            if st.button("✅ START CONVERSION", use_container_width=True, type="primary"):
-                st.session_state.conversion_started = True
-            else:
-                st.session_state.conversion_started = False
-        else:
-            st.button("✅ START CONVERSION", use_container_width=True, disabled=True)
-            st.warning("Please select files to enable conversion")
-        
-        # Conversion results area
-        if st.session_state.get('conversion_started', False) and st.session_state.all_files:
-            st.markdown("---")
-            st.subheader("🔄 Conversion Progress")
-            
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            successful_conversions = 0
-            failed_conversions = 0
-            conversion_log = []
-            
-            # Create zip file in memory
-            zip_buffer = BytesIO()
-            
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                total_files = len(st.session_state.all_files)
-                
-                for i, file in enumerate(st.session_state.all_files):
-                    # Update progress
-                    progress = (i / total_files)
-                    progress_bar.progress(progress)
-                    status_text.text(f"🔄 Processing {i+1}/{total_files}: {file.name}")
-                    
-                    # Convert file
-                    try:
-                        file_content = file.read()
-                        success, result = convert_excel_to_xml(file_content, file.name)
-                        
-                        if success:
-                            xml_filename = file.name.rsplit('.', 1)[0] + '.xml'
-                            zip_file.writestr(xml_filename, result)
-                            successful_conversions += 1
-                            conversion_log.append(f"✅ SUCCESS: {file.name}")
-                        else:
-                            error_filename = file.name + '_ERROR.txt'
-                            zip_file.writestr(error_filename, f"Conversion failed: {result}")
-                            failed_conversions += 1
-                            conversion_log.append(f"❌ FAILED: {file.name} - {result}")
-                            
-                    except Exception as e:
-                        error_filename = file.name + '_ERROR.txt'
-                        zip_file.writestr(error_filename, f"Unexpected error: {str(e)}")
-                        failed_conversions += 1
-                        conversion_log.append(f"💥 ERROR: {file.name} - {str(e)}")
-                    
-                    # Small delay for smooth progress animation
-                    time.sleep(0.1)
-                
-                # Final progress update
-                progress_bar.progress(1.0)
-                status_text.text("✅ Conversion completed!")
-            
-            zip_buffer.seek(0)
-            
-            # Results summary
-            st.markdown("---")
-            st.subheader("📊 Conversion Results")
-            
-            # Metrics in columns
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("Total Files", total_files)
-            with col2:
-                st.metric("Successful", successful_conversions)
-            with col3:
-                st.metric("Failed", failed_conversions)
-            
-            # Success rate
-            success_rate = (successful_conversions / total_files * 100) if total_files > 0 else 0
-            st.metric("Success Rate", f"{success_rate:.1f}%")
-            
-            # Conversion log
-            with st.expander("View Conversion Log", expanded=True):
-                log_content = "\n".join(conversion_log)
-                st.text_area("Conversion Log", log_content, height=150, key="conversion_log")
-            
-            # Download button
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            st.download_button(
-                label="📥 DOWNLOAD ASYCUDA XML FILES (ZIP)",
-                data=zip_buffer.getvalue(),
-                file_name=f"ASYCUDA_XML_Output_{timestamp}.zip",
-                mime="application/zip",
-                use_container_width=True,
-                type="primary"
-            )
-            
-            # Clear files after successful download
-            if st.button("🔄 Start New Conversion", use_container_width=True):
-                st.session_state.all_files = []
-                st.session_state.conversion_started = False
-                st.rerun()
+        conversion_panel()
+        results_panel()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,256 @@
+"""Compare two batches of generated ASYCUDA XML field by field.
+
+Each side is an XML file, an output zip, or a directory of XML files and zips
+(for example the volumes of a split download). Files are paired by name and a
+pair whose size and CRC-32 match is skipped without being parsed; for zips the
+CRC is read from the archive directory, so unchanged files are not even
+decompressed. Changed pairs are streamed with iterparse in a worker pool, Item
+elements are aligned by position or by commodity code, and every differing
+field is reported.
+
+Usage:
+    python compare.py OLD NEW [--align position|commodity] [--workers 4] [--ignore 'SAD/Properties/Forms/*'] [--json report.json]
+
+Exits with 1 when the batches differ or a file cannot be read, like diff.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import sys
+import time
+import zipfile
+import zlib
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import zip_longest
+from xml.etree.ElementTree import ParseError, iterparse
+
+ITEM_TAG = 'Item'
+COMMODITY_FIELD = 'Tariff/Harmonized_system/Commodity_code'
+CHUNK_SIZE = 1024 * 1024
+
+# Sources: (path, zip member or None, size, crc or None)
+
+def collect_sources(path):
+    """XML files under a path by name, from plain files and from zips"""
+    sources = {}
+
+    def add_zip(zip_path):
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                if info.filename.lower().endswith('.xml'):
+                    sources[info.filename] = (zip_path, info.filename, info.file_size, info.CRC)
+
+    if os.path.isdir(path):
+        for root, _, filenames in os.walk(path):
+            for filename in sorted(filenames):
+                full_path = os.path.join(root, filename)
+                if filename.lower().endswith('.zip'):
+                    add_zip(full_path)
+                elif filename.lower().endswith('.xml'):
+                    name = os.path.relpath(full_path, path).replace(os.sep, '/')
+                    sources[name] = (full_path, None, os.path.getsize(full_path), None)
+    elif path.lower().endswith('.zip'):
+        add_zip(path)
+    else:
+        sources[os.path.basename(path)] = (path, None, os.path.getsize(path), None)
+    return sources
+
+# Reading the directory of a large zip is costly, so each worker keeps its archives open
+_archives = {}
+
+def open_source(source):
+    """Binary stream of a source, decompressed on the fly for zip members"""
+    path, member, _, _ = source
+    if member is None:
+        return open(path, 'rb')
+    if path not in _archives:
+        _archives[path] = zipfile.ZipFile(path)
+    return _archives[path].open(member)
+
+def source_crc(source):
+    """CRC-32 of a source, from the zip directory when available"""
+    if source[3] is not None:
+        return source[3]
+    crc = 0
+    with open_source(source) as stream:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def flatten(elem, prefix, fields, skip=None):
+    """Leaf values under an element by path, with [n] for the n-th sibling of the same name"""
+    seen = {}
+    for child in elem:
+        tag = child.tag
+        if tag == skip:
+            continue
+        count = seen[tag] = seen.get(tag, 0) + 1
+        path = f"{prefix}{tag}" if count == 1 else f"{prefix}{tag}[{count}]"
+        if len(child):
+            flatten(child, path + '/', fields, skip)
+        else:
+            fields[path] = (child.text or '').strip()
+
+def iter_records(stream, header):
+    """Stream a declaration: Items are yielded as {field path: value}, the other fields go into `header`
+
+    Item paths are relative to the Item, e.g. Tariff/Supplementary_unit[2]/Supplementary_unit_quantity;
+    header paths are relative to the root.
+    """
+    elem = None
+    for _, elem in iterparse(stream):
+        if elem.tag == ITEM_TAG:
+            item = {}
+            flatten(elem, '', item)
+            yield item
+            # Only an empty shell of each finished Item stays in the tree
+            elem.clear()
+    # The last element to end is the root
+    if elem is not None:
+        flatten(elem, '', header, skip=ITEM_TAG)
+
+def commodity_key(item, seen):
+    """Commodity code, numbered when the same code appears on several Items"""
+    code = item.get(COMMODITY_FIELD, '')
+    seen[code] += 1
+    return code if seen[code] == 1 else f"{code}#{seen[code]}"
+
+def is_ignored(field, ignore):
+    return any(fnmatch.fnmatchcase(field, pattern) for pattern in ignore)
+
+def diff_fields(location, old, new, ignore, differences):
+    """Append (location, field, old value, new value) for every field that differs"""
+    for field in sorted(set(old) | set(new)):
+        old_value = old.get(field)
+        new_value = new.get(field)
+        if old_value != new_value and not is_ignored(field, ignore):
+            differences.append((location, field, old_value, new_value))
+
+def compare_pair(name, old_source, new_source, align='position', ignore=(), full=False):
+    """Compare one pair of declarations (runs inside a worker process)
+
+    A malformed, truncated or unreadable file gives status 'error' instead of
+    aborting the whole comparison.
+    """
+    try:
+        return diff_pair(name, old_source, new_source, align, ignore, full)
+    except (ParseError, OSError, EOFError, RuntimeError, zipfile.BadZipFile, zlib.error) as e:
+        return {'name': name, 'status': 'error', 'error': f"{type(e).__name__}: {e}", 'differences': []}
+
+def diff_pair(name, old_source, new_source, align, ignore, full):
+    """Field-level differences of one pair, skipping it when the CRCs match"""
+    if not full and old_source[2] == new_source[2] and source_crc(old_source) == source_crc(new_source):
+        return {'name': name, 'status': 'unchanged', 'differences': []}
+
+    old_header = {}
+    new_header = {}
+    differences = []
+    with open_source(old_source) as old_stream, open_source(new_source) as new_stream:
+        old_items = iter_records(old_stream, old_header)
+        new_items = iter_records(new_stream, new_header)
+        if align == 'commodity':
+            old_seen = Counter()
+            pending = {commodity_key(item, old_seen): item for item in old_items}
+            new_seen = Counter()
+            for item in new_items:
+                key = commodity_key(item, new_seen)
+                diff_fields(f"Item {key}", pending.pop(key, {}), item, ignore, differences)
+            for key, item in pending.items():
+                diff_fields(f"Item {key}", item, {}, ignore, differences)
+        else:
+            # Both files are read in lockstep, one Item at a time
+            for number, (old_item, new_item) in enumerate(zip_longest(old_items, new_items), start=1):
+                diff_fields(f"Item {number}", old_item or {}, new_item or {}, ignore, differences)
+    diff_fields('Header', old_header, new_header, ignore, differences)
+
+    return {'name': name, 'status': 'changed' if differences else 'identical', 'differences': differences}
+
+def compare_pair_args(args):
+    return compare_pair(*args)
+
+def format_value(value):
+    return '(missing)' if value is None else repr(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two batches of ASYCUDA XML field by field")
+    parser.add_argument('old', help="XML file, output zip, or directory of XML files and zips")
+    parser.add_argument('new', help="XML file, output zip, or directory of XML files and zips")
+    parser.add_argument('--align', choices=('position', 'commodity'), default='position',
+                        help="Pair Items by their position or by their commodity code")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument('--ignore', action='append', default=[],
+                        help="Field path pattern to ignore, e.g. 'SAD/Properties/Forms/*' (repeatable)")
+    parser.add_argument('--full', action='store_true', help="Parse every pair, even when the CRCs match")
+    parser.add_argument('--max-diffs', type=int, default=20, help="Differences printed per file (0 = all)")
+    parser.add_argument('--json', help="Also write the full report to this JSON file")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    old_sources = collect_sources(args.old)
+    new_sources = collect_sources(args.new)
+    # Two single files are compared whatever their names
+    if len(old_sources) == 1 and len(new_sources) == 1 and not (os.path.isdir(args.old) or os.path.isdir(args.new)):
+        (old_name, old_source), = old_sources.items()
+        (new_name, new_source), = new_sources.items()
+        name = old_name if old_name == new_name else f"{old_name} -> {new_name}"
+        old_sources, new_sources = {name: old_source}, {name: new_source}
+
+    names = sorted(set(old_sources) & set(new_sources))
+    only_old = sorted(set(old_sources) - set(new_sources))
+    only_new = sorted(set(new_sources) - set(old_sources))
+    pairs = [(name, old_sources[name], new_sources[name], args.align, tuple(args.ignore), args.full) for name in names]
+    print(f"🔍 Comparing {args.old} -> {args.new}: {len(pairs)} pairs, aligning Items by {args.align}")
+
+    if args.workers > 1 and len(pairs) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(compare_pair_args, pairs, chunksize=max(len(pairs) // (args.workers * 4), 1)))
+    else:
+        results = [compare_pair_args(pair) for pair in pairs]
+
+    counts = defaultdict(int)
+    for result in results:
+        counts[result['status']] += 1
+        if result['status'] == 'error':
+            print(f"! {result['name']}: {result['error']}")
+            continue
+        if result['status'] != 'changed':
+            continue
+        differences = result['differences']
+        print(f"~ {result['name']}: {len(differences)} difference(s)")
+        shown = differences if args.max_diffs == 0 else differences[:args.max_diffs]
+        for location, field, old_value, new_value in shown:
+            print(f"    {location}  {field}: {format_value(old_value)} -> {format_value(new_value)}")
+        if len(shown) < len(differences):
+            print(f"    ... and {len(differences) - len(shown)} more")
+    for name in only_old:
+        print(f"- only in {args.old}: {name}")
+    for name in only_new:
+        print(f"+ only in {args.new}: {name}")
+
+    elapsed = time.perf_counter() - started
+    print(f"📊 {counts['unchanged']} unchanged (CRC), {counts['identical']} identical once parsed, "
+          f"{counts['changed']} changed, {counts['error']} unreadable, {len(only_old)} only in old, {len(only_new)} only in new "
+          f"in {elapsed:.2f}s")
+
+    if args.json:
+        report = {
+            'old': args.old,
+            'new': args.new,
+            'align': args.align,
+            'files': [{**result, 'differences': [
+                {'location': location, 'field': field, 'old': old_value, 'new': new_value}
+                for location, field, old_value, new_value in result['differences']
+            ]} for result in results],
+            'only_in_old': only_old,
+            'only_in_new': only_new,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report written to {args.json}")
+
+    sys.exit(1 if counts['changed'] or counts['error'] or only_old or only_new else 0)
+
+if __name__ == "__main__":
+    main()
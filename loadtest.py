@@ -0,0 +1,164 @@
+"""Load-testing harness for the ASYCUDA XML converter.
+
+Simulates N concurrent sessions, each converting M synthetic workbooks the way
+the Streamlit page does (convert, then write into an in-memory zip), and reports
+per-file latency percentiles, throughput and peak RSS for every concurrency level.
+
+Usage:
+    python loadtest.py --concurrency 1,2,4,8 --files 10 --items 50
+    python loadtest.py --concurrency 1,4 --files 5 --app   # drive batch.py through Streamlit's AppTest
+"""
+import argparse
+import json
+import math
+import resource
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+
+import pandas as pd
+
+def make_workbook(items=50):
+    """Build a synthetic workbook with one SAD row and `items` Items rows"""
+    sad = pd.DataFrame([{
+        'Reference Number': 'LOADTEST',
+        'Consignee_code': '10026483',
+        'Consignee_name': 'Load Test Consignee',
+        'Exporter_name': 'Load Test Exporter',
+        'Trading_country': 'US',
+    }])
+    items_df = pd.DataFrame([{
+        'Number_of_packages': 1 + i % 5,
+        'Kind_of_packages_code': 'STKS',
+        'Commodity_code': f"{84710000 + i}",
+        'Country_of_origin_code': 'US',
+        'Description_of_goods': f"Synthetic goods line {i + 1}",
+        'Commercial_description': 'Load test',
+        'Gross_weight_itm': 0.5 + i,
+        'Net_weight_itm': 0.4 + i,
+        'Invoice Amount_foreign_currency': round(10.25 * (i + 1), 2),
+        'Supplementary_unit_quantity_1': 1 + i % 5,
+    } for i in range(items)])
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        sad.to_excel(writer, sheet_name='SAD', index=False)
+        items_df.to_excel(writer, sheet_name='Items', index=False)
+    return buffer.getvalue()
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def engine_session(workbook, files, latencies, errors, lock):
+    """One simulated user converting `files` workbooks into a zip"""
+    from batch import convert_excel_to_xml, xml_filename_for
+
+    zip_buffer = BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for i in range(files):
+            filename = f"loadtest_{threading.get_ident()}_{i}.xlsx"
+            started = time.perf_counter()
+            success, result = convert_excel_to_xml(workbook, filename)
+            if success:
+                zip_file.writestr(xml_filename_for(filename), result)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not success:
+                    errors.append(result)
+
+def app_session(files, latencies, errors, lock):
+    """One simulated browser session rerunning the Streamlit page `files` times"""
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file('batch.py', default_timeout=120)
+    for _ in range(files):
+        started = time.perf_counter()
+        app.run()
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            errors.extend(str(e.value) for e in app.exception)
+
+def run_level(concurrency, files, workbook, app_mode):
+    """Run one concurrency level (inside a fresh process so peak RSS is per level)"""
+    import batch  # noqa: F401  -- import cost is excluded from the measurement
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    if app_mode:
+        target, args = app_session, (files, latencies, errors, lock)
+    else:
+        target, args = engine_session, (workbook, files, latencies, errors, lock)
+
+    threads = [threading.Thread(target=target, args=args) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'files': len(latencies),
+        'errors': len(errors),
+        'wall_seconds': round(wall_time, 3),
+        'throughput_per_second': round(len(latencies) / wall_time, 2) if wall_time else 0,
+        'p50_seconds': round(percentile(latencies, 50), 4),
+        'p95_seconds': round(percentile(latencies, 95), 4),
+        'p99_seconds': round(percentile(latencies, 99), 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the ASYCUDA XML converter")
+    parser.add_argument('--concurrency', default='1,2,4,8', help="Comma-separated numbers of concurrent sessions")
+    parser.add_argument('--files', type=int, default=10, help="Workbooks converted per session (page reruns with --app)")
+    parser.add_argument('--items', type=int, default=50, help="Items rows per synthetic workbook")
+    parser.add_argument('--app', action='store_true',
+                        help="Drive batch.py through Streamlit's AppTest instead of the conversion engine")
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    workbook = make_workbook(args.items)
+    mode = "Streamlit page reruns" if args.app else f"conversions ({args.items} items, {len(workbook) / 1024:.0f} KB per workbook)"
+    print(f"📈 Load test: {args.files} {mode} per session")
+
+    header = f"{'sessions':>8} {'files':>6} {'errors':>6} {'wall s':>8} {'files/s':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'peak RSS MB':>12}"
+    print(header)
+    print('-' * len(header))
+
+    results = []
+    for concurrency in levels:
+        # A fresh process per level keeps ru_maxrss from carrying over between levels
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            result = executor.submit(run_level, concurrency, args.files, workbook, args.app).result()
+        results.append(result)
+        print(f"{result['concurrency']:>8} {result['files']:>6} {result['errors']:>6} {result['wall_seconds']:>8.2f} "
+              f"{result['throughput_per_second']:>8.2f} {result['p50_seconds']:>8.3f} {result['p95_seconds']:>8.3f} "
+              f"{result['p99_seconds']:>8.3f} {result['peak_rss_mb']:>12.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Opt-in profiling of a conversion batch.
+
+Runs the batch under cProfile and attributes time to the conversion stages, so
+customers can send a profile of a slow batch instead of their workbooks. The
+profile only holds function names and timings from this code base, no data.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+# Stage name -> (part of the source path, function name) as recorded by cProfile
+PROFILED_STAGES = {
+    'preflight_workbook': ('/batch.py', 'preflight_workbook'),
+    'read_excel_declarations': ('/batch.py', 'read_excel_declarations'),
+    'create_asycuda_xml': ('/batch.py', 'create_asycuda_xml'),
+    'create_item_element': ('/batch.py', 'create_item_element'),
+    'add_element': ('/batch.py', 'add_element'),
+    'prettify_xml': ('/batch.py', 'prettify_xml'),
+    'zip_write': ('/zipfile', 'writestr'),
+}
+PROFILE_DIR = 'profile'
+TOP_N = 40
+
+# Stage timers replace module globals, so only one batch at a time may install them
+_stage_timing_lock = threading.Lock()
+# From Python 3.12 cProfile uses the process-wide sys.monitoring, so only one batch at a time may profile
+_profile_lock = threading.Lock()
+
+class BatchProfiler:
+    """Context manager that profiles the calling thread and adds the results to the output zip
+
+    With stage_timing=True the stage functions in `namespace` (the globals of the
+    module that calls them) are also wrapped with wall-clock timers, which costs
+    a little extra per call. Only calls from the profiled thread are counted.
+    """
+
+    def __init__(self, namespace, stage_timing=False, top_n=TOP_N):
+        self.namespace = namespace
+        self.stage_timing = stage_timing
+        self.top_n = top_n
+        self.profile = cProfile.Profile()
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = defaultdict(int)
+        self.originals = {}
+        self.timed_methods = []
+        self.thread_id = None
+        self.stage_timing_installed = False
+        self.profiled = False
+        self.wall_seconds = 0.0
+        self.started = None
+
+    def timed(self, stage, func):
+        """Wrap a callable so its wall time is added to a stage"""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if threading.get_ident() != self.thread_id:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stage_seconds[stage] += time.perf_counter() - started
+                self.stage_calls[stage] += 1
+        return wrapper
+
+    def time_method(self, obj, attr, stage):
+        """Time a method of one object (e.g. the ZipFile's writestr); call inside the with block"""
+        if self.stage_timing_installed:
+            setattr(obj, attr, self.timed(stage, getattr(obj, attr)))
+            self.timed_methods.append((obj, attr))
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        # Another session is already timing stages; fall back to cProfile only
+        if self.stage_timing and _stage_timing_lock.acquire(blocking=False):
+            self.stage_timing_installed = True
+            for stage in PROFILED_STAGES:
+                func = self.namespace.get(stage)
+                if callable(func):
+                    self.originals[stage] = func
+                    self.namespace[stage] = self.timed(stage, func)
+        self.started = time.perf_counter()
+        # Another session is already profiling; the batch runs unprofiled and the summary says so
+        if _profile_lock.acquire(blocking=False):
+            try:
+                self.profile.enable()
+                self.profiled = True
+            except ValueError:
+                # Another profiling tool (e.g. a debugger) is active in this process
+                _profile_lock.release()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiled:
+            self.profile.disable()
+            _profile_lock.release()
+        self.wall_seconds = time.perf_counter() - self.started
+        for obj, attr in self.timed_methods:
+            delattr(obj, attr)
+        self.timed_methods = []
+        if self.stage_timing_installed:
+            self.namespace.update(self.originals)
+            self.originals = {}
+            _stage_timing_lock.release()
+        return False
+
+    def stage_totals(self):
+        """Cumulative seconds and call counts per stage, from the cProfile data"""
+        stats = pstats.Stats(self.profile).stats
+        totals = {}
+        for stage, (file_part, func_name) in PROFILED_STAGES.items():
+            seconds = 0.0
+            calls = 0
+            for (filename, _, name), (_, total_calls, _, cumulative, _) in stats.items():
+                if name == func_name and file_part in filename.replace(os.sep, '/'):
+                    seconds += cumulative
+                    calls += total_calls
+            totals[stage] = (seconds, calls)
+        return totals
+
+    def summary_text(self):
+        """Readable report: time per stage, then the top functions"""
+        if not self.profiled:
+            return self.unprofiled_summary_text()
+        lines = [
+            "ASYCUDA XML conversion profile",
+            f"Batch wall time: {self.wall_seconds:.3f}s",
+            "",
+            "Time per stage (cumulative, includes nested stages; add_element runs inside create_item_element):",
+            f"{'stage':<26}{'calls':>10}{'profiled s':>14}{'% of batch':>12}" + (f"{'wall s':>12}" if self.stage_timing else ""),
+        ]
+        if self.stage_timing and not self.stage_timing_installed:
+            lines.insert(3, "(Wall-clock stage timing skipped: another batch was being timed at the same time.)")
+        if sys.version_info >= (3, 12):
+            lines.insert(3, "(On Python 3.12+ the profile also includes conversions of other sessions running at the same time.)")
+        for stage, (seconds, calls) in self.stage_totals().items():
+            share = seconds / self.wall_seconds * 100 if self.wall_seconds else 0
+            line = f"{stage:<26}{calls:>10}{seconds:>14.3f}{share:>11.1f}%"
+            if self.stage_timing:
+                line += f"{self.stage_seconds.get(stage, 0.0):>12.3f}"
+            lines.append(line)
+
+        for sort_key, title in (('cumulative', 'cumulative time'), ('tottime', 'own time')):
+            stream = io.StringIO()
+            stats = pstats.Stats(self.profile, stream=stream)
+            stats.strip_dirs().sort_stats(sort_key).print_stats(self.top_n)
+            lines += ["", f"Top {self.top_n} functions by {title}:", stream.getvalue().strip()]
+        return "\n".join(lines) + "\n"
+
+    def unprofiled_summary_text(self):
+        """Report for a batch that could not be profiled, with the wall-clock stage timings if any"""
+        lines = [
+            "ASYCUDA XML conversion profile",
+            f"Batch wall time: {self.wall_seconds:.3f}s",
+            "",
+            "Profiling skipped: another batch (or profiling tool) was profiling this server at the same time.",
+        ]
+        if self.stage_timing_installed:
+            lines += ["", "Wall time per stage:", f"{'stage':<26}{'calls':>10}{'wall s':>12}"]
+            for stage in PROFILED_STAGES:
+                lines.append(f"{stage:<26}{self.stage_calls.get(stage, 0):>10}{self.stage_seconds.get(stage, 0.0):>12.3f}")
+        return "\n".join(lines) + "\n"
+
+    def pstats_bytes(self):
+        """Raw profile, loadable with pstats or snakeviz"""
+        fd, path = tempfile.mkstemp(suffix='.pstats')
+        os.close(fd)
+        try:
+            self.profile.dump_stats(path)
+            with open(path, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+    def archive_entries(self, name='conversion_profile'):
+        """(path, data) of the .pstats file (if the batch was profiled) and the text summary for the output zip"""
+        entries = [(f"{PROFILE_DIR}/{name}.txt", self.summary_text())]
+        if self.profiled:
+            entries.insert(0, (f"{PROFILE_DIR}/{name}.pstats", self.pstats_bytes()))
+        return entries
@@ -0,0 +1,177 @@
+"""Reference tables for code-to-name enrichment and code validation.
+
+Each table is a CSV file with ``code,name`` columns in the ``reference``
+directory (or the directory in ASYCUDA_REFERENCE_DIR):
+
+    countries.csv      country codes (Trading_country, Export_country_code, ...)
+    offices.csv        customs office codes
+    package_kinds.csv  kind of packages codes
+    units.csv          supplementary unit codes
+    hs_codes.csv       HS commodity codes
+
+Names are always looked up, but codes are only validated against a table whose
+first line is ``# complete``, so a partial list never reports real codes as
+unknown. Of the shipped files only countries.csv (ISO 3166-1 with the Dutch
+names, plus AN and XK) is complete. package_kinds.csv and units.csv hold the
+common UN/ECE Recommendation 21 and 20 codes next to national codes such as
+STKS, and offices.csv only the offices this consignment uses; add the missing
+codes of the ASYCUDA installation and the marker to have them validated.
+
+The first lookup in a process compiles the CSV into a binary hash table and
+memory-maps it, so lookups are O(1) without per-request file I/O and the pages
+are shared between worker processes. The compiled tables are cached in the
+user's cache folder (or ASYCUDA_REFERENCE_CACHE_DIR) and rebuilt when the CSV
+changes; without a usable cache folder the table is built in memory instead.
+"""
+import csv
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+REFERENCE_DIR = os.environ.get('ASYCUDA_REFERENCE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference'))
+CACHE_DIR = os.environ.get('ASYCUDA_REFERENCE_CACHE_DIR', os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'asycuda_reference'))
+
+# Compiled layout: header, then n_slots fixed-size slots, then the UTF-8 strings
+MAGIC = b'ASYREF02'
+HEADER = struct.Struct('<8sIIII')  # magic, n_slots, n_entries, strings_offset, complete
+SLOT = struct.Struct('<IIII')  # code_offset, code_length (0 = empty), name_offset, name_length
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+def normalize_code(code):
+    """Codes are compared upper-case, without spaces or dots (HS codes are often written 8471.30)"""
+    return str(code).strip().upper().replace(' ', '').replace('.', '')
+
+def build_table(csv_path):
+    """Binary hash table for one CSV file"""
+    entries = {}
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        lines = f.readlines()
+    complete = bool(lines) and lines[0].strip().replace(' ', '').lower() == '#complete'
+    for row in csv.DictReader(line for line in lines if not line.startswith('#')):
+        code = normalize_code(row.get('code') or '')
+        if code:
+            entries[code] = (row.get('name') or '').strip()
+
+    n_slots = 1
+    while n_slots < max(len(entries) * 2, 1):
+        n_slots *= 2
+    slots = [(0, 0, 0, 0)] * n_slots
+    strings = bytearray()
+    for code, name in entries.items():
+        code_bytes = code.encode('utf-8')
+        name_bytes = name.encode('utf-8')
+        slot = zlib.crc32(code_bytes) & (n_slots - 1)
+        while slots[slot][1]:
+            slot = (slot + 1) & (n_slots - 1)
+        slots[slot] = (len(strings), len(code_bytes), len(strings) + len(code_bytes), len(name_bytes))
+        strings += code_bytes + name_bytes
+
+    strings_offset = HEADER.size + n_slots * SLOT.size
+    data = bytearray(HEADER.pack(MAGIC, n_slots, len(entries), strings_offset, int(complete)))
+    for slot in slots:
+        data += SLOT.pack(*slot)
+    # mmap cannot map an empty region, so there is always at least one byte of strings
+    return bytes(data + (strings or b'\0'))
+
+def compile_table(csv_path, output_path):
+    """Write the binary hash table for one CSV file, atomically"""
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(build_table(csv_path))
+    os.replace(tmp_path, output_path)
+
+def map_file(compiled_path):
+    """Read-only memory map of a compiled table"""
+    with open(compiled_path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class ReferenceTable:
+    """Code -> name table with open addressing, over a memory map or bytes of a compiled table"""
+
+    def __init__(self, data):
+        self.map = data
+        if len(data) < HEADER.size:
+            raise ValueError("Not a compiled reference table")
+        magic, self.n_slots, self.n_entries, self.strings_offset, complete = HEADER.unpack_from(data, 0)
+        self.complete = bool(complete)
+        # A stale or damaged cache file must not be read past its end
+        if (magic != MAGIC or self.n_slots & (self.n_slots - 1) or self.n_entries >= self.n_slots
+                or self.strings_offset != HEADER.size + self.n_slots * SLOT.size or self.strings_offset >= len(data)):
+            raise ValueError("Not a compiled reference table")
+
+    def __len__(self):
+        return self.n_entries
+
+    def _find(self, code):
+        code_bytes = normalize_code(code).encode('utf-8')
+        if not code_bytes:
+            return None
+        slot = zlib.crc32(code_bytes) & (self.n_slots - 1)
+        while True:
+            code_offset, code_length, name_offset, name_length = SLOT.unpack_from(self.map, HEADER.size + slot * SLOT.size)
+            if code_length == 0:
+                return None
+            start = self.strings_offset + code_offset
+            if code_length == len(code_bytes) and self.map[start:start + code_length] == code_bytes:
+                start = self.strings_offset + name_offset
+                return self.map[start:start + name_length].decode('utf-8')
+            slot = (slot + 1) & (self.n_slots - 1)
+
+    def name(self, code, default=''):
+        """Name for a code, or `default` if the code is unknown"""
+        name = self._find(code)
+        return default if name is None else name
+
+    def __contains__(self, code):
+        return self._find(code) is not None
+
+def get_table(table_name):
+    """Load a table once per process (compiling it if the CSV changed)"""
+    table = _tables.get(table_name)
+    if table is not None:
+        return table
+    with _tables_lock:
+        if table_name not in _tables:
+            csv_path = os.path.join(REFERENCE_DIR, f"{table_name}.csv")
+            _tables[table_name] = load_table(table_name, csv_path) if os.path.exists(csv_path) else None
+        return _tables[table_name]
+
+def load_table(table_name, csv_path):
+    """Map the table from the cache, compiling it first if needed; in memory if the cache is unusable"""
+    stat = os.stat(csv_path)
+    source_id = f"{zlib.crc32(csv_path.encode('utf-8')):08x}-{stat.st_size}-{stat.st_mtime_ns}"
+    compiled_path = os.path.join(CACHE_DIR, f"{table_name}-{source_id}-{MAGIC.decode()}.bin")
+    try:
+        try:
+            return ReferenceTable(map_file(compiled_path))
+        except (FileNotFoundError, ValueError):
+            os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+            compile_table(csv_path, compiled_path)
+            return ReferenceTable(map_file(compiled_path))
+    except OSError:
+        return ReferenceTable(build_table(csv_path))
+
+def lookup_name(table_name, code, default=''):
+    """Name for a code from a reference table, or `default` if unknown"""
+    table = get_table(table_name)
+    return table.name(code, default) if table is not None else default
+
+def is_known(table_name, code):
+    """Whether a code is in a table; None unless the table is marked complete"""
+    table = get_table(table_name)
+    if table is None or not table.complete:
+        return None
+    return code in table
+
+def is_known_commodity(code):
+    """HS codes are valid if the code or its 6- or 4-digit heading is listed"""
+    code = normalize_code(code)
+    results = [is_known('hs_codes', code[:length]) for length in (len(code), 6, 4) if length <= len(code)]
+    if results and results[0] is None:
+        return None
+    return any(results)
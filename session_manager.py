@@ -0,0 +1,161 @@
+"""Per-session memory budget for uploaded files and conversion results.
+
+Every browser session registers the bytes it holds in uploaded files and stores
+its large artifacts (the output zip) here instead of in ``st.session_state``.
+Artifacts above the spill threshold, or that would break a memory cap, are moved
+to disk. Sessions that stay idle longer than the TTL lose their artifacts; their
+uploads keep counting while the browser session is open, because Streamlit holds
+uploaded files until the session closes.
+
+Not covered: uploads of a disconnected session that Streamlit has not closed yet,
+the data frames and XML of conversions in progress, and Streamlit's own caches.
+
+Limits are configured through environment variables:
+    ASYCUDA_SESSION_MEMORY_MB    per-session memory cap (default 500)
+    ASYCUDA_GLOBAL_MEMORY_MB     memory cap across all sessions (default 2048)
+    ASYCUDA_SPILL_THRESHOLD_MB   artifacts larger than this go to disk (default 10)
+    ASYCUDA_SESSION_TTL_MINUTES  idle time before a session is evicted (default 30)
+"""
+import os
+import tempfile
+import threading
+import time
+
+MB = 1024 * 1024
+SESSION_MEMORY_LIMIT = int(os.environ.get('ASYCUDA_SESSION_MEMORY_MB', '500')) * MB
+GLOBAL_MEMORY_LIMIT = int(os.environ.get('ASYCUDA_GLOBAL_MEMORY_MB', '2048')) * MB
+SPILL_THRESHOLD = int(os.environ.get('ASYCUDA_SPILL_THRESHOLD_MB', '10')) * MB
+SESSION_IDLE_TTL = int(os.environ.get('ASYCUDA_SESSION_TTL_MINUTES', '30')) * 60
+
+class Artifact:
+    """A stored result, kept in memory or spilled to a temporary file"""
+
+    def __init__(self, spool, size, in_memory):
+        self.spool = spool
+        self.size = size
+        self.in_memory = in_memory
+
+class SessionResources:
+    """Bytes held by one browser session"""
+
+    def __init__(self):
+        self.last_seen = time.time()
+        self.upload_bytes = 0
+        self.artifacts = {}
+
+    @property
+    def memory_bytes(self):
+        return self.upload_bytes + sum(a.size for a in self.artifacts.values() if a.in_memory)
+
+    @property
+    def disk_bytes(self):
+        return sum(a.size for a in self.artifacts.values() if not a.in_memory)
+
+class SessionResourceManager:
+    """Tracks memory held per session and enforces per-session and global caps"""
+
+    def __init__(self, storage_dir=None, session_limit=SESSION_MEMORY_LIMIT, global_limit=GLOBAL_MEMORY_LIMIT,
+                 spill_threshold=SPILL_THRESHOLD, idle_ttl=SESSION_IDLE_TTL, is_session_open=None):
+        self.storage_dir = storage_dir or tempfile.mkdtemp(prefix='asycuda_sessions_')
+        self.session_limit = session_limit
+        self.global_limit = global_limit
+        self.spill_threshold = spill_threshold
+        self.idle_ttl = idle_ttl
+        self.is_session_open = is_session_open  # session id -> whether its uploaded files are still held
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def _session(self, session_id):
+        if session_id not in self.sessions:
+            self.sessions[session_id] = SessionResources()
+        return self.sessions[session_id]
+
+    def _memory_in_use(self):
+        return sum(s.memory_bytes for s in self.sessions.values())
+
+    def _drop_artifact(self, session, key):
+        artifact = session.artifacts.pop(key, None)
+        if artifact is not None:
+            artifact.spool.close()
+
+    def touch(self, session_id):
+        """Mark a session as active and evict sessions that have been idle too long"""
+        now = time.time()
+        with self.lock:
+            self._session(session_id).last_seen = now
+            for other_id, session in list(self.sessions.items()):
+                if other_id != session_id and now - session.last_seen > self.idle_ttl:
+                    for key in list(session.artifacts):
+                        self._drop_artifact(session, key)
+                    # An idle but open session still pins its uploads, so they stay counted
+                    if not (session.upload_bytes and self.is_session_open and self.is_session_open(other_id)):
+                        del self.sessions[other_id]
+
+    def track_uploads(self, session_id, nbytes):
+        """Record the size of a session's uploaded files; returns an error message if over a cap"""
+        with self.lock:
+            session = self._session(session_id)
+            session.upload_bytes = nbytes
+            if session.memory_bytes > self.session_limit:
+                return (f"Selected files use {session.memory_bytes / MB:.0f} MB, above the "
+                        f"{self.session_limit / MB:.0f} MB limit per session. "
+                        f"Remove some files or split the batch.")
+            if self._memory_in_use() > self.global_limit:
+                return (f"The server is holding {self._memory_in_use() / MB:.0f} MB for all users, above its "
+                        f"{self.global_limit / MB:.0f} MB limit. Select fewer files or try again in a few minutes.")
+            return None
+
+    def spool(self):
+        """File to build an artifact in; it moves itself to disk past the spill threshold"""
+        return tempfile.SpooledTemporaryFile(max_size=self.spill_threshold, dir=self.storage_dir)
+
+    def put(self, session_id, key, data):
+        """Store an artifact (bytes or a spool) in memory if it fits, otherwise on disk"""
+        if isinstance(data, (bytes, bytearray)):
+            spool = self.spool()
+            spool.write(data)
+        else:
+            spool = data
+        spool.seek(0, os.SEEK_END)
+        size = spool.tell()
+
+        with self.lock:
+            session = self._session(session_id)
+            self._drop_artifact(session, key)
+            in_memory = (size <= self.spill_threshold
+                         and session.memory_bytes + size <= self.session_limit
+                         and self._memory_in_use() + size <= self.global_limit)
+            if not in_memory:
+                spool.rollover()
+            session.artifacts[key] = Artifact(spool, size, in_memory)
+
+    def has(self, session_id, key):
+        """Whether an artifact is still stored (it is gone once released or evicted)"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            return bool(session) and key in session.artifacts
+
+    def get(self, session_id, key):
+        """Contents of an artifact, or None if it was released or evicted"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            artifact = session.artifacts.get(key) if session else None
+            if artifact is None:
+                return None
+            artifact.spool.seek(0)
+            return artifact.spool.read()
+
+    def release(self, session_id, key=None):
+        """Free one artifact of a session, or all of them"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return
+            for artifact_key in ([key] if key else list(session.artifacts)):
+                self._drop_artifact(session, artifact_key)
+
+    def usage(self, session_id):
+        """Bytes held by a session in memory and on disk"""
+        with self.lock:
+            session = self._session(session_id)
+            return {'memory_bytes': session.memory_bytes, 'disk_bytes': session.disk_bytes}
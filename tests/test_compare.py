@@ -0,0 +1,46 @@
+"""Structural diff between two batches of generated XML."""
+import zipfile
+
+from compare import collect_sources, compare_pair
+
+DECLARATION = """<ASYCUDA><SAD><Properties><Sad_flow>I</Sad_flow></Properties></SAD><Items>{items}</Items></ASYCUDA>"""
+ITEM = """<Item><Tariff><Harmonized_system><Commodity_code>{code}</Commodity_code></Harmonized_system>
+<Supplementary_unit><Supplementary_unit_quantity>1</Supplementary_unit_quantity></Supplementary_unit>
+<Supplementary_unit><Supplementary_unit_quantity>{quantity}</Supplementary_unit_quantity></Supplementary_unit>
+</Tariff></Item>"""
+
+def write_declaration(path, *items):
+    path.write_text(DECLARATION.format(items=''.join(ITEM.format(code=code, quantity=quantity) for code, quantity in items)))
+    return collect_sources(str(path))[path.name]
+
+def test_field_differences_by_position(tmp_path):
+    old = write_declaration(tmp_path / 'old.xml', ('84710000', 1), ('84720000', 2))
+    new = write_declaration(tmp_path / 'new.xml', ('84710000', 1), ('84720000', 5), ('84730000', 1))
+    result = compare_pair('d.xml', old, new)
+    assert result['status'] == 'changed'
+    assert ('Item 2', 'Tariff/Supplementary_unit[2]/Supplementary_unit_quantity', '2', '5') in result['differences']
+    assert ('Item 3', 'Tariff/Harmonized_system/Commodity_code', None, '84730000') in result['differences']
+
+def test_commodity_alignment_ignores_item_order(tmp_path):
+    old = write_declaration(tmp_path / 'old.xml', ('84710000', 1), ('84720000', 2))
+    new = write_declaration(tmp_path / 'new.xml', ('84720000', 2), ('84710000', 1))
+    assert compare_pair('d.xml', old, new, align='position')['status'] == 'changed'
+    assert compare_pair('d.xml', old, new, align='commodity')['status'] == 'identical'
+
+def test_unchanged_zip_members_are_skipped_by_crc(tmp_path):
+    content = DECLARATION.format(items=ITEM.format(code='84710000', quantity=1))
+    for name in ('old.zip', 'new.zip'):
+        with zipfile.ZipFile(tmp_path / name, 'w') as archive:
+            archive.writestr('d.xml', content)
+    old = collect_sources(str(tmp_path / 'old.zip'))['d.xml']
+    new = collect_sources(str(tmp_path / 'new.zip'))['d.xml']
+    assert compare_pair('d.xml', old, new)['status'] == 'unchanged'
+    assert compare_pair('d.xml', old, new, full=True)['status'] == 'identical'
+
+def test_malformed_file_is_reported_not_raised(tmp_path):
+    old = write_declaration(tmp_path / 'old.xml', ('84710000', 1))
+    (tmp_path / 'new.xml').write_text('<ASYCUDA><SAD><Properties>')
+    new = collect_sources(str(tmp_path / 'new.xml'))['new.xml']
+    result = compare_pair('d.xml', old, new)
+    assert result['status'] == 'error'
+    assert result['error'].startswith('ParseError')
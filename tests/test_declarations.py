@@ -0,0 +1,85 @@
+"""Splitting multi-declaration workbooks into one XML per SAD row."""
+from io import BytesIO
+
+import pandas as pd
+import pytest
+
+from batch import (DECLARATION_KEY, convert_excel_to_xml, convert_workbook_to_xmls,
+                   declaration_filenames, read_excel_declarations)
+
+def make_workbook(sad_rows, item_rows):
+    """Workbook bytes with the given SAD and Items rows"""
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        pd.DataFrame(sad_rows).to_excel(writer, sheet_name='SAD', index=False)
+        pd.DataFrame(item_rows).to_excel(writer, sheet_name='Items', index=False)
+    return buffer.getvalue()
+
+def item(reference, code='84710000'):
+    return {DECLARATION_KEY: reference, 'Commodity_code': code, 'Description_of_goods': 'Goods'}
+
+def declaration(reference):
+    return {DECLARATION_KEY: reference, 'Consignee_code': '1', 'Consignee_name': 'X'}
+
+def test_items_are_split_by_reference():
+    workbook = make_workbook([declaration('R1'), declaration('R2')],
+                             [item('R1'), item('R2'), item('R1'), item('R2'), item('R2')])
+    declarations = read_excel_declarations(workbook)
+    assert [(reference, len(items)) for reference, _, items in declarations] == [('R1', 2), ('R2', 3)]
+
+def test_numeric_references_match_across_sheets():
+    workbook = make_workbook([declaration(101), declaration(102)], [item(101.0), item(102)])
+    declarations = read_excel_declarations(workbook)
+    assert [(reference, len(items)) for reference, _, items in declarations] == [('101', 1), ('102', 1)]
+
+def test_declaration_without_items_still_gets_its_xml():
+    workbook = make_workbook([declaration('R1'), declaration('R2')], [item('R1')])
+    outputs = convert_workbook_to_xmls(workbook, 'batch.xlsx')
+    assert [(name, success) for name, success, _ in outputs] == [('batch_R1.xml', True), ('batch_R2.xml', True)]
+
+def test_single_sad_row_keeps_the_workbook_name():
+    workbook = make_workbook([declaration('R1')], [item('R1'), item('R1')])
+    outputs = convert_workbook_to_xmls(workbook, 'single.xlsx')
+    assert [(name, success) for name, success, _ in outputs] == [('single.xml', True)]
+
+@pytest.mark.parametrize('sad_refs, item_refs, message', [
+    (['R1', 'R1'], ['R1'], 'Duplicate Reference Number in SAD sheet: R1'),
+    (['R1', None], ['R1'], 'SAD row 3 has no Reference Number'),
+    (['R1', 'R2'], ['R1', 'R3', 'R9'], 'Items reference Reference Number not found in SAD sheet: R3, R9'),
+    (['R1', 'R2'], ['R1', None, 'R2', None], 'Items rows 3, 5 have no Reference Number'),
+])
+def test_invalid_references_fail_the_workbook(sad_refs, item_refs, message):
+    workbook = make_workbook([declaration(ref) for ref in sad_refs], [item(ref) for ref in item_refs])
+    outputs = convert_workbook_to_xmls(workbook, 'bad.xlsx')
+    assert len(outputs) == 1
+    name, success, result = outputs[0]
+    assert (name, success) == ('bad.xlsx_ERROR.txt', False)
+    assert message in result
+
+def test_references_that_sanitize_alike_get_unique_names():
+    names = declaration_filenames('m.xlsx', ['A/1', 'A_1', 'a 1', 'A_1_2'])
+    assert names == ['m_A_1.xml', 'm_A_1_2.xml', 'm_a_1_3.xml', 'm_A_1_2_2.xml']
+    assert len({name.lower() for name in names}) == len(names)
+
+def test_colliding_references_produce_distinct_outputs():
+    workbook = make_workbook([declaration('A/1'), declaration('A_1')], [item('A/1'), item('A_1')])
+    outputs = convert_workbook_to_xmls(workbook, 'm.xlsx')
+    assert [name for name, _, _ in outputs] == ['m_A_1.xml', 'm_A_1_2.xml']
+
+def test_convert_excel_to_xml_uses_the_workbook_path():
+    workbook = make_workbook([declaration('R1')], [item('R1')])
+    success, xml_content = convert_excel_to_xml(workbook, 'single.xlsx')
+    assert success
+    assert xml_content == convert_workbook_to_xmls(workbook, 'single.xlsx')[0][2]
+
+    multi = make_workbook([declaration('R1'), declaration('R2')], [item('R1'), item('R2')])
+    success, message = convert_excel_to_xml(multi, 'multi.xlsx')
+    assert not success and '2 declarations' in message
+
+def test_cells_are_read_as_their_string_form():
+    row = dict(declaration('R1'), Date=pd.Timestamp('2025-03-01'), Rate=1.5, Empty=None)
+    (_, sad_data, items), = read_excel_declarations(make_workbook([row], [dict(item('R1'), Quantity=3)]))
+    assert sad_data['Date'] == '2025-03-01 00:00:00'
+    assert sad_data['Rate'] == '1.5'
+    assert sad_data['Empty'] == ''
+    assert items[0]['Quantity'] == '3'
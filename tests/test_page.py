@@ -0,0 +1,19 @@
+"""The Streamlit page, driven through AppTest."""
+import os
+
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'batch.py')
+
+def test_page_renders_without_files():
+    app = AppTest.from_file(APP_PATH, default_timeout=30).run()
+    assert not app.exception
+    assert app.session_state['rendered_selection'] == (False, None)
+
+def test_changed_selection_reruns_the_page_once():
+    app = AppTest.from_file(APP_PATH, default_timeout=30).run()
+    # What the conversion panel last rendered no longer matches the (empty) selection
+    app.session_state['rendered_selection'] = (True, None)
+    app.run()
+    assert not app.exception
+    assert app.session_state['rendered_selection'] == (False, None)
@@ -0,0 +1,45 @@
+"""Opt-in batch profiling."""
+import threading
+
+from profiling import BatchProfiler
+
+def stage(n):
+    return sum(range(n))
+
+def test_profile_has_pstats_and_summary():
+    namespace = {'create_asycuda_xml': stage}
+    with BatchProfiler(namespace, stage_timing=True) as profiler:
+        namespace['create_asycuda_xml'](1000)
+    assert namespace['create_asycuda_xml'] is stage
+    assert profiler.profiled and profiler.stage_calls['create_asycuda_xml'] == 1
+    paths = [path for path, _ in profiler.archive_entries()]
+    assert paths == ['profile/conversion_profile.pstats', 'profile/conversion_profile.txt']
+
+def test_concurrent_batch_is_not_profiled():
+    entered = threading.Event()
+    release = threading.Event()
+
+    def first_batch():
+        with BatchProfiler({}):
+            entered.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=first_batch)
+    thread.start()
+    try:
+        assert entered.wait(5)
+        with BatchProfiler({}) as second:
+            stage(1000)
+    finally:
+        release.set()
+        thread.join()
+
+    assert not second.profiled
+    entries = dict(second.archive_entries())
+    assert list(entries) == ['profile/conversion_profile.txt']
+    assert 'Profiling skipped' in entries['profile/conversion_profile.txt']
+
+    # The lock is released again, so the next batch is profiled
+    with BatchProfiler({}) as third:
+        stage(1000)
+    assert third.profiled
@@ -0,0 +1,64 @@
+"""Reference tables: name lookups and validation against complete tables only."""
+import pytest
+
+import reference_data
+from batch import check_reference_codes, reference_name
+
+@pytest.fixture
+def reference_dir(tmp_path, monkeypatch):
+    """Point the module at a fresh reference and cache directory"""
+    monkeypatch.setattr(reference_data, 'REFERENCE_DIR', str(tmp_path / 'reference'))
+    monkeypatch.setattr(reference_data, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(reference_data, '_tables', {})
+    (tmp_path / 'reference').mkdir()
+    return tmp_path / 'reference'
+
+def test_lookup_normalizes_codes(reference_dir):
+    (reference_dir / 'countries.csv').write_text("code,name\nUS,Verenigde Staten\nAW,Aruba\n")
+    assert reference_data.lookup_name('countries', ' us') == 'Verenigde Staten'
+    assert reference_data.lookup_name('countries', 'NL', default='?') == '?'
+    assert reference_data.lookup_name('missing_table', 'US') == ''
+
+def test_partial_tables_are_not_used_for_validation(reference_dir):
+    (reference_dir / 'countries.csv').write_text("code,name\nUS,Verenigde Staten\n")
+    assert reference_data.is_known('countries', 'NL') is None
+    assert check_reference_codes({'Trading_country': 'NL'}, []) == []
+
+def test_complete_tables_report_unknown_codes(reference_dir):
+    (reference_dir / 'countries.csv').write_text("# complete\ncode,name\nUS,Verenigde Staten\nNL,Nederland\n")
+    (reference_dir / 'hs_codes.csv').write_text("#complete\ncode,name\n847130,Laptops\n")
+    assert reference_data.is_known('countries', 'nl') is True
+    assert reference_data.lookup_name('countries', 'NL') == 'Nederland'
+    assert reference_data.is_known_commodity('8471.30.10') is True
+    assert check_reference_codes({'Trading_country': 'XX'}, [{'Commodity_code': '99999999'}]) == [
+        'Unknown Trading_country: XX', 'Unknown Commodity_code: 99999999']
+
+def test_sheet_names_win_even_when_blank(reference_dir):
+    (reference_dir / 'countries.csv').write_text("code,name\nUS,Verenigde Staten\n")
+    assert reference_name({'Export_country_name': ''}, 'Export_country_name', 'countries', 'US') == ''
+    assert reference_name({'Export_country_name': 'USA'}, 'Export_country_name', 'countries', 'US') == 'USA'
+    assert reference_name({}, 'Export_country_name', 'countries', 'US') == 'Verenigde Staten'
+
+def test_shipped_country_table_is_complete(tmp_path, monkeypatch):
+    monkeypatch.setattr(reference_data, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(reference_data, '_tables', {})
+    assert reference_data.lookup_name('countries', 'NL') == 'Nederland'
+    assert reference_data.lookup_name('countries', 'CW') == 'Curaçao'
+    assert reference_data.is_known('countries', 'XX') is False
+    assert reference_data.lookup_name('units', 'PCE') == 'Aantal Stucks'
+    assert reference_data.is_known('package_kinds', 'PX') is None
+
+def test_damaged_cache_files_are_rebuilt(reference_dir):
+    (reference_dir / 'countries.csv').write_text("code,name\nUS,Verenigde Staten\n")
+    assert reference_data.lookup_name('countries', 'US') == 'Verenigde Staten'
+    for compiled in (reference_dir.parent / 'cache').iterdir():
+        compiled.write_bytes(reference_data.MAGIC + b'\xff' * 40)
+    reference_data._tables.clear()
+    assert reference_data.lookup_name('countries', 'US') == 'Verenigde Staten'
+
+def test_unusable_cache_falls_back_to_memory(reference_dir, monkeypatch):
+    (reference_dir / 'countries.csv').write_text("# complete\ncode,name\nUS,Verenigde Staten\n")
+    (reference_dir.parent / 'not_a_dir').write_text('')
+    monkeypatch.setattr(reference_data, 'CACHE_DIR', str(reference_dir.parent / 'not_a_dir' / 'cache'))
+    assert reference_data.lookup_name('countries', 'US') == 'Verenigde Staten'
+    assert reference_data.is_known('countries', 'NL') is False
@@ -0,0 +1,29 @@
+"""Session memory accounting and idle eviction."""
+import time
+
+from session_manager import SessionResourceManager
+
+def test_eviction_keeps_uploads_of_open_sessions(tmp_path):
+    open_sessions = {'idle-open'}
+    manager = SessionResourceManager(storage_dir=str(tmp_path), global_limit=1000, idle_ttl=60,
+                                     is_session_open=lambda session_id: session_id in open_sessions)
+    for session_id in ('idle-open', 'idle-closed'):
+        manager.track_uploads(session_id, 400)
+        manager.put(session_id, 'zip', b'x' * 100)
+        manager.sessions[session_id].last_seen = time.time() - 120
+
+    manager.touch('active')
+
+    assert not manager.has('idle-open', 'zip')
+    assert 'idle-closed' not in manager.sessions
+    assert manager.usage('idle-open')['memory_bytes'] == 400
+    # The open session's uploads still count toward the global cap
+    assert manager.track_uploads('active', 700) is not None
+    assert manager.track_uploads('active', 500) is None
+
+def test_eviction_without_session_check_forgets_sessions(tmp_path):
+    manager = SessionResourceManager(storage_dir=str(tmp_path), idle_ttl=60)
+    manager.track_uploads('idle', 400)
+    manager.sessions['idle'].last_seen = time.time() - 120
+    manager.touch('active')
+    assert 'idle' not in manager.sessions
@@ -0,0 +1,54 @@
+"""Splitting the output archive into zip volumes with manifests."""
+import csv
+import io
+import random
+import zipfile
+
+from session_manager import SessionResourceManager
+from volumes import MANIFEST_NAME, VolumeWriter
+
+def make_writer(tmp_path, **limits):
+    manager = SessionResourceManager(storage_dir=str(tmp_path))
+    writer = VolumeWriter(manager, 'session', lambda number: f"part{number:03d}.zip", **limits)
+    return manager, writer
+
+def volume_manifest(manager, volume):
+    archive = zipfile.ZipFile(io.BytesIO(manager.get('session', volume['key'])))
+    return list(csv.DictReader(io.StringIO(archive.read(MANIFEST_NAME).decode('utf-8'))))
+
+def test_workbook_limit_keeps_each_workbooks_outputs_together(tmp_path):
+    manager, writer = make_writer(tmp_path, max_workbooks=2)
+    with writer:
+        writer.add('a.xlsx', [('a.xml', '<a/>')], 'converted')
+        writer.add('m.xlsx', [('m_R1.xml', '<m/>'), ('m_R2.xml', '<m/>')], 'converted')
+        writer.add('b.xlsx', [('b.xlsx_ERROR.txt', 'failed')], 'failed')
+    assert [volume['workbooks'] for volume in writer.volumes] == [['a.xlsx', 'm.xlsx'], ['b.xlsx']]
+    assert [row['output_file'] for row in volume_manifest(manager, writer.volumes[0])] == ['a.xml', 'm_R1.xml', 'm_R2.xml']
+
+def test_size_limit_bounds_compressed_volumes(tmp_path):
+    manager, writer = make_writer(tmp_path, max_bytes=20000)
+    with writer:
+        for i in range(12):
+            # Random content does not compress, so each workbook adds about 6 KB
+            writer.add(f"wb{i}.xlsx", [(f"x{i}.xml", random.Random(i).randbytes(6000))], 'converted')
+    assert len(writer.volumes) > 1
+    assert all(volume['size'] <= 20000 for volume in writer.volumes)
+
+def test_appended_files_are_listed_but_not_counted(tmp_path):
+    manager, writer = make_writer(tmp_path, max_workbooks=1)
+    with writer:
+        writer.add('a.xlsx', [('a.xml', '<a/>')], 'converted')
+        writer.add('b.xlsx', [('b.xml', '<b/>')], 'converted')
+        writer.append('', [('profile/conversion_profile.txt', 'profile')], 'profile')
+    last = writer.volumes[-1]
+    assert last['workbooks'] == ['b.xlsx'] and last['files'] == 2
+    assert [row['output_file'] for row in volume_manifest(manager, last)] == ['b.xml', 'profile/conversion_profile.txt']
+    assert 'profile/conversion_profile.txt' in writer.manifest_csv()
+
+def test_without_limits_there_is_one_archive_without_manifest(tmp_path):
+    manager, writer = make_writer(tmp_path)
+    with writer:
+        writer.add('a.xlsx', [('a.xml', '<a/>')], 'converted')
+    assert len(writer.volumes) == 1
+    archive = zipfile.ZipFile(io.BytesIO(manager.get('session', 'volume_1')))
+    assert archive.namelist() == ['a.xml']
@@ -0,0 +1,137 @@
+"""Output archive split into size- or count-bounded zip volumes.
+
+Large batches can be written as a series of zip volumes instead of one archive.
+A volume is finalised as soon as the next workbook would not fit, stored in the
+session manager and reported through a callback, so it can be downloaded (and
+uploaded to ASYCUDA) while the rest of the batch is still converting.
+
+All outputs of one workbook always go into the same volume. Each volume holds a
+manifest.csv of its own workbooks, and manifest_csv() lists the whole batch.
+"""
+import csv
+import io
+import zipfile
+
+MB = 1024 * 1024
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_COLUMNS = ['volume', 'volume_file', 'source_workbook', 'status', 'output_file']
+
+class VolumeWriter:
+    """Writes each workbook's outputs into the current volume, starting a new volume when it is full
+
+    max_bytes bounds the compressed size of a volume and max_workbooks the number of
+    workbooks in it; without either limit everything goes into a single volume, as
+    one archive without a manifest. The size bound is checked before a workbook is
+    added, using the compression ratio seen so far, so a volume only goes over it
+    when a single workbook's output is larger than the limit.
+    """
+
+    def __init__(self, session_manager, session_id, file_name_for, max_bytes=None, max_workbooks=None,
+                 on_open=None, on_finalised=None):
+        self.session_manager = session_manager
+        self.session_id = session_id
+        self.file_name_for = file_name_for  # volume number -> download file name
+        self.max_bytes = max_bytes or None
+        self.max_workbooks = max_workbooks or None
+        self.split = bool(self.max_bytes or self.max_workbooks)
+        self.on_open = on_open  # called with each new ZipFile
+        self.on_finalised = on_finalised  # called with each finalised volume
+        self.volumes = []
+        self.manifest = []
+        self.current = None
+        self.spool = None
+        self.zip_file = None
+        self.written_bytes = 0  # uncompressed bytes written, for the compression ratio
+        self.compressed_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _is_full(self, nbytes):
+        if self.max_workbooks and len(self.current['workbooks']) >= self.max_workbooks:
+            return True
+        if self.max_bytes:
+            ratio = self.compressed_bytes / self.written_bytes if self.written_bytes else 1.0
+            return self.spool.tell() + nbytes * ratio > self.max_bytes
+        return False
+
+    def current_zip(self):
+        """ZipFile of the volume being filled, opening a new volume if needed"""
+        if self.zip_file is None:
+            number = len(self.volumes) + 1
+            self.current = {
+                'number': number,
+                'key': f"volume_{number}",
+                'file_name': self.file_name_for(number),
+                'workbooks': [],
+                'files': 0,
+                'size': 0,
+            }
+            self.spool = self.session_manager.spool()
+            self.zip_file = zipfile.ZipFile(self.spool, 'w', zipfile.ZIP_DEFLATED)
+            if self.on_open is not None:
+                self.on_open(self.zip_file)
+        return self.zip_file
+
+    def add(self, source_name, entries, status):
+        """Write the (file name, data) outputs of one workbook; status is recorded in the manifest"""
+        entries = [(name, data.encode('utf-8') if isinstance(data, str) else data) for name, data in entries]
+        nbytes = sum(len(data) for _, data in entries)
+        if self.zip_file is not None and self.current['workbooks'] and self._is_full(nbytes):
+            self.finalise()
+        self.append(source_name, entries, status)
+
+    def append(self, source_name, entries, status):
+        """Write files into the current volume whatever its size (e.g. the batch profile)"""
+        entries = [(name, data.encode('utf-8') if isinstance(data, str) else data) for name, data in entries]
+        nbytes = sum(len(data) for _, data in entries)
+        zip_file = self.current_zip()
+        started_at = self.spool.tell()
+        for name, data in entries:
+            zip_file.writestr(name, data)
+            self.manifest.append([self.current['number'], self.current['file_name'], source_name, status, name])
+        self.written_bytes += nbytes
+        self.compressed_bytes += self.spool.tell() - started_at
+        # Files without a source workbook are listed in the manifest but not counted as one
+        if source_name:
+            self.current['workbooks'].append(source_name)
+        self.current['files'] += len(entries)
+
+    def finalise(self):
+        """Close the current volume and store it in the session manager"""
+        if self.zip_file is None:
+            return None
+        volume = self.current
+        if self.split:
+            rows = [row for row in self.manifest if row[0] == volume['number']]
+            self.zip_file.writestr(MANIFEST_NAME, self._csv(rows))
+        self.zip_file.close()
+        volume['size'] = self.spool.tell()
+        self.session_manager.put(self.session_id, volume['key'], self.spool)
+        self.volumes.append(volume)
+        self.current = self.spool = self.zip_file = None
+        if self.on_finalised is not None:
+            self.on_finalised(volume)
+        return volume
+
+    def close(self):
+        """Finalise the last volume (an empty batch still gets one archive); returns all volumes"""
+        if self.zip_file is None and not self.volumes:
+            self.current_zip()
+        self.finalise()
+        return self.volumes
+
+    def _csv(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(MANIFEST_COLUMNS)
+        writer.writerows(rows)
+        return buffer.getvalue()
+
+    def manifest_csv(self):
+        """Which source workbook went to which volume, for the whole batch"""
+        return self._csv(self.manifest)
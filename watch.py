@@ -0,0 +1,210 @@
+"""Hot-folder watcher that converts Excel workbooks to ASYCUDA XML as they land.
+
+Usage:
+    python watch.py INPUT_DIR OUTPUT_DIR [--workers 4] [--interval 2] [--settle 5] [--once]
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+from batch import convert_workbook_to_xmls, error_filename_for
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls', '.xlsm')
+LEDGER_FILENAME = '.processed.json'
+STATUS_FILENAME = 'watch_status.json'
+THROUGHPUT_WINDOW = 60  # seconds
+
+def convert_file(path):
+    """Convert one workbook on disk (runs inside a worker process)"""
+    started = time.perf_counter()
+    filename = os.path.basename(path)
+    try:
+        with open(path, 'rb') as f:
+            file_content = f.read()
+        outputs = convert_workbook_to_xmls(file_content, filename)
+    except Exception as e:
+        outputs = [(error_filename_for(filename), False, f"{filename} | Error: {str(e)}")]
+    return outputs, time.perf_counter() - started
+
+def write_atomic(path, content):
+    """Write a file so readers never see it half-written"""
+    tmp_path = path + '.tmp'
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    encoding = None if isinstance(content, bytes) else 'utf-8'
+    with open(tmp_path, mode, encoding=encoding) as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def fingerprint(stat):
+    """Identify a version of a file by size and modification time"""
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+class HotFolderWatcher:
+    """Polls a directory and converts workbooks once they are fully written"""
+
+    def __init__(self, input_dir, output_dir, workers=4, interval=2.0, settle=5.0):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.workers = workers
+        self.interval = interval
+        self.settle = settle
+        self.ledger_path = os.path.join(output_dir, LEDGER_FILENAME)
+        self.status_path = os.path.join(output_dir, STATUS_FILENAME)
+        self.ledger = self.load_ledger()
+        self.candidates = {}  # name -> (fingerprint, time the fingerprint was first seen)
+        self.ready = deque()  # (name, fingerprint) waiting for a worker
+        self.in_flight = {}  # future -> (name, fingerprint)
+        self.completed_times = deque()
+        self.started_at = datetime.now()
+        self.succeeded = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    def load_ledger(self):
+        """Load the record of already-processed files so restarts skip them"""
+        try:
+            with open(self.ledger_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_ledger(self):
+        write_atomic(self.ledger_path, json.dumps(self.ledger, indent=2))
+
+    def scan(self):
+        """Find new or changed workbooks and queue those that have stopped growing"""
+        now = time.time()
+        queued = {name for name, _ in self.ready} | {name for name, _ in self.in_flight.values()}
+        seen = set()
+        for entry in os.scandir(self.input_dir):
+            name = entry.name
+            # Skip hidden files, Excel lock files and anything that is not a workbook
+            if name.startswith(('.', '~$')) or not name.lower().endswith(EXCEL_EXTENSIONS):
+                continue
+            if not entry.is_file() or name in queued:
+                continue
+            seen.add(name)
+            stat = entry.stat()
+            current = fingerprint(stat)
+            if self.ledger.get(name, {}).get('fingerprint') == current:
+                self.candidates.pop(name, None)
+                continue
+            previous = self.candidates.get(name)
+            if previous is None or previous[0] != current:
+                self.candidates[name] = (current, now)
+                continue
+            # Ready when neither size nor mtime changed for the settle period
+            if now - previous[1] >= self.settle and now - stat.st_mtime >= self.settle:
+                del self.candidates[name]
+                self.ready.append((name, current))
+        for name in list(self.candidates):
+            if name not in seen:
+                del self.candidates[name]
+
+    def dispatch(self, pool):
+        """Hand queued files to the pool without letting it grow unbounded"""
+        while self.ready and len(self.in_flight) < self.workers * 2:
+            name, current = self.ready.popleft()
+            future = pool.submit(convert_file, os.path.join(self.input_dir, name))
+            self.in_flight[future] = (name, current)
+
+    def collect(self, timeout):
+        """Write the results of finished conversions"""
+        if not self.in_flight:
+            return
+        done, _ = wait(list(self.in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            name, current = self.in_flight.pop(future)
+            try:
+                outputs, elapsed = future.result()
+            except Exception as e:
+                outputs, elapsed = [(error_filename_for(name), False, f"{name} | Error: {str(e)}")], 0.0
+
+            for output_name, output_success, result in outputs:
+                content = result if output_success else f"Conversion failed: {result}"
+                write_atomic(os.path.join(self.output_dir, output_name), content)
+
+            failures = [result for _, output_success, result in outputs if not output_success]
+            success = not failures
+            error_path = os.path.join(self.output_dir, error_filename_for(name))
+            if success:
+                if os.path.exists(error_path):
+                    os.remove(error_path)
+                self.succeeded += 1
+                print(f"✅ SUCCESS: {name} -> {len(outputs)} XML file(s) ({elapsed:.2f}s)")
+            else:
+                self.failed += 1
+                print(f"❌ FAILED: {name} - {failures[0]}")
+
+            self.busy_seconds += elapsed
+            self.completed_times.append(time.time())
+            self.ledger[name] = {
+                'fingerprint': current,
+                'success': success,
+                'outputs': [output_name for output_name, _, _ in outputs],
+                'processed_at': datetime.now().isoformat(timespec='seconds'),
+            }
+        if done:
+            self.save_ledger()
+
+    def write_status(self):
+        """Publish throughput and queue depth for monitoring"""
+        now = time.time()
+        while self.completed_times and now - self.completed_times[0] > THROUGHPUT_WINDOW:
+            self.completed_times.popleft()
+        processed = self.succeeded + self.failed
+        status = {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'updated_at': datetime.now().isoformat(timespec='seconds'),
+            'workers': self.workers,
+            'queue_depth': len(self.ready),
+            'in_flight': len(self.in_flight),
+            'waiting_to_settle': len(self.candidates),
+            'processed': processed,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'files_per_minute': len(self.completed_times) * 60 / THROUGHPUT_WINDOW,
+            'avg_seconds_per_file': round(self.busy_seconds / processed, 3) if processed else 0,
+        }
+        write_atomic(self.status_path, json.dumps(status, indent=2))
+
+    def run(self, once=False):
+        """Watch the input directory until interrupted (or until idle with once=True)"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                while True:
+                    self.scan()
+                    self.dispatch(pool)
+                    self.collect(timeout=self.interval)
+                    self.write_status()
+                    if once and not (self.ready or self.in_flight or self.candidates):
+                        break
+                    if not self.in_flight:
+                        time.sleep(self.interval)
+            except KeyboardInterrupt:
+                print("🛑 Stopping watcher...")
+            finally:
+                while self.in_flight:
+                    self.collect(timeout=None)
+                self.write_status()
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert Excel workbooks dropped into a folder to ASYCUDA XML")
+    parser.add_argument('input_dir', help="Directory to watch for Excel files")
+    parser.add_argument('output_dir', help="Directory for XML and error files")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Number of conversion processes")
+    parser.add_argument('--interval', type=float, default=2.0, help="Seconds between directory scans")
+    parser.add_argument('--settle', type=float, default=5.0, help="Seconds a file must stay unchanged before it is converted")
+    parser.add_argument('--once', action='store_true', help="Convert what is in the folder and exit")
+    args = parser.parse_args()
+
+    watcher = HotFolderWatcher(args.input_dir, args.output_dir, args.workers, args.interval, args.settle)
+    watcher.run(once=args.once)
+
+if __name__ == "__main__":
+    main()